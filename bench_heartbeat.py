@@ -0,0 +1,139 @@
+# ==========================
+# 🏋️ HEARTBEAT LOAD BENCHMARK
+# ==========================
+# Seeds N licenses, starts main.py in a scratch directory and drives it with M
+# clients doing the real /verify claim + refresh cycle. Prints a JSON report:
+#
+#   python bench_heartbeat.py --licenses 10000 --clients 50 --duration 30 --out run.json
+#
+# Extra server settings (storage / serving modes) go through --env KEY=VALUE.
+import argparse, json, os, random, string, subprocess, sys, tempfile, threading, time, requests
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def seed_licenses(path, count, plugin):
+    expires = (datetime.now() + timedelta(days=365)).strftime("%Y-%m-%d")
+    keys = []
+    data = {}
+    for i in range(count):
+        key = ''.join(random.choices(string.ascii_uppercase + string.digits, k=16))
+        data[key] = {"user": f"bench{i}", "plugin": plugin, "expires": expires,
+                     "in_use": False, "bound_to": None, "last_check": None}
+        keys.append(key)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+    return keys
+
+def start_server(workdir, port, env_overrides, cmd):
+    env = dict(os.environ, PORT=str(port), KEEPALIVE_URL="", **env_overrides)
+    proc = subprocess.Popen(cmd or [sys.executable, os.path.join(HERE, "main.py")], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"server exited with code {proc.returncode}")
+        try:
+            if requests.get(base + "/", timeout=1).ok:
+                return proc, base
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("server did not come up within 60s")
+
+def scrape(base):
+    values = {}
+    for line in requests.get(base + "/metrics", timeout=5).text.splitlines():
+        if line and not line.startswith("#") and "{" not in line:
+            name, value = line.split()
+            values[name] = float(value)
+    return values
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(len(sorted_values) * p / 100), len(sorted_values) - 1)]
+
+def client(base, key, user_id, plugin, interval, stop, results):
+    session = requests.Session()
+    params = {"key": key, "user_id": user_id, "plugin": plugin}
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            r = session.get(base + "/verify", params=params, timeout=10)
+            body = r.json()
+            outcome = body.get("reason") or body.get("note") or str(r.status_code)
+            error = not body.get("valid")
+        except Exception as e:
+            outcome, error = type(e).__name__, True
+        results.append((time.perf_counter() - started, outcome, error))
+        if interval:
+            stop.wait(interval)
+
+def run(args):
+    with tempfile.TemporaryDirectory(prefix="bench_heartbeat_") as workdir:
+        return bench(args, workdir)
+
+def bench(args, workdir):
+    keys = seed_licenses(os.path.join(workdir, "licenses.json"), args.licenses, args.plugin)
+    env = dict(kv.split("=", 1) for kv in args.env)
+    proc, base = start_server(workdir, args.port, env, args.server_cmd.split() if args.server_cmd else None)
+    try:
+        before = scrape(base)
+        stop, results, threads = threading.Event(), [], []
+        for i in range(args.clients):
+            t = threading.Thread(target=client, daemon=True,
+                                 args=(base, keys[i % len(keys)], f"bench-host-{i}", args.plugin, args.interval, stop, results))
+            threads.append(t)
+        started = time.perf_counter()
+        for t in threads: t.start()
+        time.sleep(args.duration)
+        stop.set()
+        for t in threads: t.join(15)
+        elapsed = time.perf_counter() - started
+        after = scrape(base)
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+    latencies = sorted(r[0] for r in results)
+    outcomes = {}
+    for _, outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    errors = sum(1 for r in results if r[2])
+    written = after.get("license_persist_bytes_total", 0) - before.get("license_persist_bytes_total", 0)
+    writes = after.get("license_persist_writes_total", 0) - before.get("license_persist_writes_total", 0)
+    return {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {"licenses": args.licenses, "clients": args.clients, "duration": args.duration,
+                   "interval": args.interval, "env": env, "server_cmd": args.server_cmd},
+        "requests": len(results),
+        "throughput_rps": len(results) / elapsed if elapsed else 0,
+        "latency_ms": {p: (percentile(latencies, int(p[1:])) or 0) * 1000 for p in ("p50", "p95", "p99")},
+        "error_rate": errors / len(results) if results else 0,
+        "outcomes": outcomes,
+        "persist_writes": writes,
+        "bytes_written": written,
+        "bytes_written_per_request": written / len(results) if results else 0,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Heartbeat load benchmark for the license server")
+    parser.add_argument("--licenses", type=int, default=1000, help="licenses to seed")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent simulated plugin hosts")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--interval", type=float, default=0, help="seconds between a client's heartbeats (0 = closed loop)")
+    parser.add_argument("--plugin", default="BenchPlugin")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE passed to the server")
+    parser.add_argument("--server-cmd", help="override the server command (run in the seeded directory)")
+    parser.add_argument("--out", help="write the JSON report here as well as stdout")
+    args = parser.parse_args()
+    if args.clients > args.licenses:
+        parser.error("--clients must not exceed --licenses (each client holds its own license)")
+    report = json.dumps(run(args), indent=2)
+    print(report)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report)
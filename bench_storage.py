@@ -0,0 +1,177 @@
+# ==========================
+# 🗄️ STORAGE MICROBENCHMARK
+# ==========================
+# Measures persistence cost per storage backend at several catalog sizes:
+# full save, single-mutation persist, cold load, peak RSS and file size.
+# Every measurement runs in a fresh child process so RSS numbers are isolated.
+#
+#   python bench_storage.py --sizes 1000,100000 --out today.json
+#   python bench_storage.py --baseline today.json --threshold 0.2   # exit 1 on regression
+import argparse, json, os, random, resource, string, subprocess, sys, tempfile, time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+METRICS = ("save_s", "persist_one_s", "load_s", "load_peak_rss_kb", "file_bytes")
+
+def synthetic_licenses(count, seed=42):
+    rng = random.Random(seed)
+    today = datetime(2026, 1, 1)
+    data = {}
+    for i in range(count):
+        key = ''.join(rng.choices(string.ascii_uppercase + string.digits, k=16))
+        bound = rng.random() < 0.3
+        plugin_id = rng.randrange(1, 51)
+        data[key] = {
+            "user": f"customer{rng.randrange(count // 3 + 1)}",
+            "plugin": f"plugin{plugin_id}",
+            "plugin_id": plugin_id,
+            "expires": (today + timedelta(days=rng.randrange(-90, 365))).strftime("%Y-%m-%d"),
+            "in_use": bound,
+            "bound_to": f"host-{rng.randrange(10 ** 6)}" if bound else None,
+            "last_check": "2026-01-01 12:00:00" if bound else None
+        }
+    return data
+
+# ==========================
+# 📦 BACKENDS
+# ==========================
+# Each backend: file name, save(path, data), persist_one(path, data, key), load(path).
+# The server module is imported inside the child (scratch cwd) so the real code paths are measured.
+def server():
+    import main
+    return main
+
+def json_save(path, data):
+    main = server()
+    main.DATA_FILE, main.licenses = path, data
+    main.save_licenses()
+
+def json_persist_one(path, data, key):
+    data[key]["last_check"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    json_save(path, data)
+
+def json_load(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def catalog_save(path, data):
+    catalog = server().LicenseCatalog(path)
+    catalog.update(data)
+    catalog.save()
+
+def catalog_persist_one(path, data, key):
+    catalog = server().LicenseCatalog(path)
+    catalog[key]["last_check"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    catalog.save()
+
+def catalog_load(path):
+    catalog = server().LicenseCatalog(path)
+    catalog[next(iter(catalog))]  # ready = first record decodable
+    return catalog
+
+BACKENDS = {
+    "json": ("licenses.json", json_save, json_persist_one, json_load),
+    "catalog": ("licenses.cat", catalog_save, catalog_persist_one, catalog_load),
+}
+
+# ==========================
+# 🧪 CHILD MEASUREMENTS
+# ==========================
+def child_write(backend, size, workdir):
+    name, save, persist_one, _ = BACKENDS[backend]
+    server()  # import outside the timed region
+    data = synthetic_licenses(size)
+    path = os.path.join(workdir, name)
+    started = time.perf_counter()
+    save(path, data)
+    save_s = time.perf_counter() - started
+    key = next(iter(data))
+    started = time.perf_counter()
+    persist_one(path, data, key)
+    persist_one_s = time.perf_counter() - started
+    return {"save_s": save_s, "persist_one_s": persist_one_s, "file_bytes": os.path.getsize(path)}
+
+def child_load(backend, size, workdir):
+    name, _, _, load = BACKENDS[backend]
+    server()  # imported outside the timed region, for every backend so the peak RSS figures compare
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    loaded = load(os.path.join(workdir, name))
+    load_s = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"load_s": load_s, "load_peak_rss_kb": peak, "load_rss_delta_kb": peak - base_rss, "loaded": len(loaded)}
+
+def run_child(mode, backend, size, workdir):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, backend, str(size), workdir],
+                         cwd=workdir, capture_output=True, text=True, check=True,
+                         env=dict(os.environ, KEEPALIVE_URL="", SCHEDULER_AUTOSTART="0"))  # no background tasks in the measurement
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+# ==========================
+# 📊 RUN / COMPARE
+# ==========================
+def measure(backend, size, repeat):
+    best = {}
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="bench_storage_") as workdir:
+            result = run_child("write", backend, size, workdir)
+            result.update(run_child("load", backend, size, workdir))
+        for k, v in result.items():
+            best[k] = v if k not in best else min(best[k], v)
+    return best
+
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for backend, sizes in results.items():
+        for size, current in sizes.items():
+            previous = baseline.get("results", {}).get(backend, {}).get(size)
+            if not previous:
+                continue
+            for metric in METRICS:
+                old, new = previous.get(metric), current.get(metric)
+                if old and new is not None and new > old * (1 + threshold):
+                    regressions.append({"backend": backend, "size": int(size), "metric": metric,
+                                        "baseline": old, "current": new, "change": new / old - 1})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage engine microbenchmark for the license server")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="comma separated license counts")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="comma separated backends: " + ", ".join(BACKENDS))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (best is kept)")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown/growth vs baseline (0.2 = 20%%)")
+    parser.add_argument("--out", help="write the JSON report here as well as stdout")
+    parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, backend, size, workdir = args.child
+        result = (child_write if mode == "write" else child_load)(backend, int(size), workdir)
+        print(json.dumps(result))
+        return 0
+
+    results = {}
+    for backend in args.backends.split(","):
+        if backend not in BACKENDS:
+            parser.error(f"unknown backend {backend!r}")
+        for size in args.sizes.split(","):
+            results.setdefault(backend, {})[size] = measure(backend, int(size), args.repeat)
+            print(f"[BENCH] {backend} x{size}: {results[backend][size]}", file=sys.stderr)
+
+    report = {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "python": sys.version.split()[0],
+              "results": results}
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = find_regressions(results, json.load(f), args.threshold)
+        status = 1 if report["regressions"] else 0
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+# ==========================
+# 🔌 LICENSE CLIENT
+# ==========================
+# Client for the /verify contract, for plugins to import instead of rolling their own polling.
+# All plugins in one host process share a LicenseClient (shared_client), which keeps one pooled
+# keep-alive session and refreshes every registered license in a single /verify/batch call.
+# Intervals are jittered and failures back off exponentially, so a fleet does not reconnect in
+# lockstep after a server restart; the last good answer is cached and honoured for a grace period
+# while the server is unreachable.
+#
+#   client = shared_client("https://licenses.example.com", user_id=machine_id)
+#   lic = client.register("MyPlugin", key, on_change=lambda lic: print(lic.valid, lic.reason))
+#   client.start()                 # background heartbeats
+#   if lic.valid: ...              # or client.check() for a synchronous round trip
+#
+# Reasons: invalid_key, wrong_plugin and missing_plugin_name are final (the license stops being
+# polled until re-registered); expired is polled every expired_interval so an /extend is picked up;
+# license_in_use and seats_full keep polling at the normal interval; rate_limited and overloaded
+# wait for the server's retry_after.
+import random, threading, time, requests
+from requests.adapters import HTTPAdapter
+
+FINAL_REASONS = {"invalid_key", "wrong_plugin", "missing_plugin_name"}
+SLOW_REASONS = {"expired"}  # polled every expired_interval instead of interval
+RETRY_REASONS = {"rate_limited", "overloaded"}
+BATCH_MAX = 64  # the server's VERIFY_BATCH_MAX
+
+class License:
+    def __init__(self, plugin, key, on_change=None):
+        self.plugin, self.key, self.on_change = plugin, key, on_change
+        self.valid = False
+        self.reason = None  # last server reason (None while valid / before the first answer)
+        self.result = {}  # last server response body
+        self.lease = None  # lease handle for /hb heartbeats
+        self.last_good = None  # time.time() of the last valid answer
+        self.final = False
+        self.due = 0.0  # monotonic time of the next check
+        self.failures = 0
+
+    def __repr__(self):
+        return f"<License {self.plugin} valid={self.valid} reason={self.reason}>"
+
+class LicenseClient:
+    def __init__(self, base_url, user_id, interval=120, jitter=0.2, timeout=10, backoff_max=600,
+                 grace=3600, pool_size=4, session=None, expired_interval=3600):
+        self.base_url, self.user_id = base_url.rstrip("/"), user_id
+        self.interval, self.jitter, self.timeout = interval, jitter, timeout  # interval < server HEARTBEAT_TIMEOUT
+        self.expired_interval = expired_interval
+        self.backoff_max, self.grace = backoff_max, grace
+        self.http = session or requests.Session()
+        self.http.mount(self.base_url, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.licenses = {}  # plugin -> License
+        self.lock = threading.RLock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.stopping = False
+        self.batch = True  # falls back to /verify + /hb against servers without /verify/batch
+
+    def register(self, plugin, key, on_change=None):
+        with self.lock:
+            lic = self.licenses[plugin] = License(plugin, key, on_change)
+            lic.due = time.monotonic()
+        self.wake.set()
+        return lic
+
+    def unregister(self, plugin):
+        with self.lock:
+            self.licenses.pop(plugin, None)
+
+    def get(self, plugin):
+        return self.licenses.get(plugin)
+
+    def is_valid(self, plugin):
+        lic = self.licenses.get(plugin)
+        return bool(lic and lic.valid)
+
+    # One synchronous round trip for every registered (or the given) license that is not final
+    def check(self, *plugins):
+        with self.lock:
+            batch = [lic for name, lic in self.licenses.items() if not lic.final and (not plugins or name in plugins)]
+        if batch:
+            self.refresh(batch)
+        return batch
+
+    def start(self):
+        if self.thread is None:
+            self.stopping = False
+            self.thread = threading.Thread(target=self.run, name="license-client", daemon=True)
+            self.thread.start()
+        return self
+
+    def close(self):
+        self.stopping = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(self.timeout + 1)
+            self.thread = None
+        self.http.close()
+
+    def run(self):
+        # Spread the first check over a fraction of the interval so restarted fleets don't align
+        with self.lock:
+            for lic in self.licenses.values():
+                lic.due = time.monotonic() + random.uniform(0, self.interval * self.jitter)
+        while not self.stopping:
+            now = time.monotonic()
+            with self.lock:
+                pending = [lic for lic in self.licenses.values() if not lic.final]
+            due = [lic for lic in pending if lic.due <= now]
+            if due:
+                # Anything due within the next half interval rides along (an early refresh is harmless),
+                # which keeps the process's licenses on one shared batch schedule
+                window = now + self.interval / 2
+                batch = [lic for lic in pending if lic.due <= window]
+                try:
+                    self.refresh(batch)
+                except Exception as e:  # whatever the server sent, the checker thread keeps going
+                    print(f"[LICENSE] Refresh failed: {e!r}")
+                    for lic in batch:
+                        self.failed(lic, repr(e))
+                continue
+            self.wake.wait(min([lic.due for lic in pending], default=now + self.interval) - now)
+            self.wake.clear()
+
+    def refresh(self, batch):
+        try:
+            if self.batch and len(batch) > 1:
+                answers = self.verify_batch(batch)
+            else:
+                answers = [self.verify_one(lic) for lic in batch]
+        except (requests.RequestException, ValueError) as e:
+            for lic in batch:
+                self.failed(lic, str(e))
+            return
+        for lic, (body, status) in zip(batch, answers):
+            self.apply(lic, body, status)
+
+    def verify_batch(self, batch):
+        if len(batch) > BATCH_MAX:
+            return [answer for i in range(0, len(batch), BATCH_MAX) for answer in self.verify_batch(batch[i:i + BATCH_MAX])]
+        if not self.batch:
+            return [self.verify_one(lic) for lic in batch]  # an earlier chunk found no batch endpoint
+        checks = [{"key": lic.key, "user_id": self.user_id, "plugin": lic.plugin} for lic in batch]
+        r = self.http.post(self.base_url + "/verify/batch", json={"checks": checks}, timeout=self.timeout)
+        if r.status_code in (404, 405):
+            self.batch = False
+            return [self.verify_one(lic) for lic in batch]
+        if r.status_code != 200:
+            body = json_object(r) if r.headers.get("Content-Type", "").startswith("application/json") else {}
+            return [(dict(body, retry_after=body.get("retry_after") or retry_after(r)), r.status_code)] * len(batch)
+        results = json_object(r).get("results")
+        if not isinstance(results, list) or len(results) != len(batch) or not all(isinstance(x, dict) for x in results):
+            raise ValueError("malformed /verify/batch response")  # a failure like any other: back off
+        return [(result, result.get("status", 200)) for result in results]
+
+    # Held leases are refreshed with the bare /hb/<handle> heartbeat; anything else re-verifies
+    def verify_one(self, lic):
+        if lic.lease and lic.valid:
+            r = self.http.post(f"{self.base_url}/hb/{lic.lease}", timeout=self.timeout)
+            if r.status_code == 204:
+                return dict(lic.result), 200
+            if r.status_code == 503:
+                return {"valid": False, "reason": "overloaded", "retry_after": retry_after(r)}, 503
+            lic.lease = None  # 410 / 404: lease gone, claim again below
+        r = self.http.get(self.base_url + "/verify", params={"key": lic.key, "user_id": self.user_id,
+                                                             "plugin": lic.plugin}, timeout=self.timeout)
+        body = json_object(r)
+        if r.status_code in (429, 503):
+            body.setdefault("retry_after", retry_after(r))
+        return body, r.status_code
+
+    # 5xx (other than overloaded) and 4xx without a reason say nothing about the license: failures
+    def apply(self, lic, body, status):
+        reason = body.get("reason")
+        if (status >= 500 and reason != "overloaded") or (status >= 400 and not reason):
+            return self.failed(lic, reason or body.get("error") or f"HTTP {status}")
+        before = (lic.valid, lic.reason)
+        lic.failures = 0
+        if reason in RETRY_REASONS:
+            # The server is fine and the license state is unknown: keep the cached answer
+            lic.due = time.monotonic() + float(body.get("retry_after") or self.interval) * random.uniform(1, 1 + self.jitter)
+            return
+        lic.result = body
+        lic.valid = bool(body.get("valid"))
+        lic.reason = None if lic.valid else reason
+        lic.lease = body.get("lease") if lic.valid else None
+        lic.final = reason in FINAL_REASONS
+        if lic.valid:
+            lic.last_good = time.time()
+        interval = self.expired_interval if reason in SLOW_REASONS else self.interval
+        lic.due = time.monotonic() + interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.notify(lic, before)
+
+    # Network error / 5xx: back off exponentially (full jitter) and keep the last good result
+    # until the grace period runs out
+    def failed(self, lic, error):
+        before = (lic.valid, lic.reason)
+        lic.failures += 1
+        backoff = min(self.backoff_max, self.interval * self.jitter * 2 ** lic.failures)
+        lic.due = time.monotonic() + random.uniform(backoff / 2, backoff)
+        if lic.valid and (lic.last_good is None or time.time() - lic.last_good > self.grace):
+            lic.valid, lic.reason = False, "unreachable"
+        elif not lic.valid and lic.reason is None:
+            lic.reason = "unreachable"
+        lic.result = dict(lic.result, error=error)
+        self.notify(lic, before)
+
+    def notify(self, lic, before):
+        if lic.on_change and (lic.valid, lic.reason) != before:
+            try:
+                lic.on_change(lic)
+            except Exception as e:
+                print(f"[LICENSE] on_change for {lic.plugin} failed: {e}")
+
+# The response's JSON object; ValueError (handled like a network error) for anything else
+def json_object(response):
+    body = response.json()
+    if not isinstance(body, dict):
+        raise ValueError(f"expected a JSON object, got {type(body).__name__}")
+    return body
+
+def retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After", 0)) or None
+    except ValueError:
+        return None
+
+# One client per (server, user_id) in the process, so independent plugins share a connection pool
+# and their heartbeats go out as one batch
+shared_clients = {}
+shared_lock = threading.Lock()
+
+def shared_client(base_url, user_id, **options):
+    with shared_lock:
+        client = shared_clients.get((base_url, user_id))
+        if client is None:
+            client = shared_clients[(base_url, user_id)] = LicenseClient(base_url, user_id, **options)
+        return client
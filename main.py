@@ -1,6 +1,10 @@
-from flask import Flask, request, jsonify, render_template_string, redirect, session
-import json, os, random, string, threading, time, requests
-from datetime import datetime, timedelta
+from flask import Flask, request, jsonify, render_template_string, redirect, session, g, has_request_context
+import json, os, sys, math, random, threading, time, requests, bisect, heapq, itertools, mmap, struct, atexit, signal, hmac, hashlib, base64, socket, secrets, sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from collections import deque, OrderedDict
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta, date
 
 app = Flask(__name__)
 app.secret_key = "SuperSecretSessionKey_ChangeThis"
@@ -9,64 +13,2069 @@ app.secret_key = "SuperSecretSessionKey_ChangeThis"
 # ⚙️ CONFIGURATION
 # ==========================
 DATA_FILE = "licenses.json"
+STORAGE_FORMAT = os.environ.get("LICENSE_STORAGE", "json")  # "json" or "catalog" (memory-mapped, lazy)
+CATALOG_FILE = "licenses.cat"
+PLUGINS_FILE = "plugins.json"  # plugin registry: ids, canonical names, per-plugin policy
+PLUGIN_ALIAS_CACHE = 10000  # raw plugin names from /verify remembered -> id (skips strip/lower)
 ADMIN_USER = "Admin@admin"
 ADMIN_PASSWORD = "@adminsecret"
 DEFAULT_EXPIRY_DAYS = 30
 HEARTBEAT_TIMEOUT = 600  # seconds before freeing license if no check
 KEEPALIVE_INTERVAL = 600  # 10 minutes (in seconds)
+KEEPALIVE_URL = os.environ.get("KEEPALIVE_URL", "https://plugin-license-server1.onrender.com")  # "" disables
+SCHEDULER_WORKERS = 4  # threads running background tasks
+SCHEDULER_AUTOSTART = os.environ.get("SCHEDULER_AUTOSTART", "1") == "1"  # start at import (WSGI servers too); tools that drive tasks themselves set 0
+TASK_JITTER = 0.1  # +/- fraction of the interval added to each periodic run
+HTTP_TIMEOUT = 10  # seconds, outbound requests from the shared session
+HTTP_POOL_SIZE = 10
+AUDIT_DIR = "audit"
+AUDIT_BUFFER = 65536  # ring buffer slots (power of two); events beyond this are dropped, not waited on
+AUDIT_FLUSH_INTERVAL = 1  # seconds between batched writes
+AUDIT_FILE_BYTES = 10 * 1024 * 1024  # rotate audit.log after this size
+AUDIT_KEEP_FILES = 10  # rotated files kept (audit.log.1 .. audit.log.N)
+AUDIT_RECENT = 10000  # events kept in memory for /audit queries
+REPLICA_OF = os.environ.get("REPLICA_OF", "").rstrip("/")  # leader base URL -> run as a read-mostly follower
+CLUSTER_TOKEN = os.environ.get("CLUSTER_TOKEN", "")  # shared secret for server-to-server endpoints
+REPLICATION_LOG_SIZE = 100000  # mutations kept in memory for followers to catch up from
+REPLICATION_POLL_TIMEOUT = 20  # seconds a follower long-polls the leader's stream
+REPLICATION_BATCH = 5000  # max mutations per stream response
+HEARTBEAT_FORWARD_INTERVAL = 1  # seconds between a follower's batched heartbeat forwards
+SHARDS = [u.rstrip("/") for u in os.environ.get("SHARDS", "").split(",") if u]  # shard base URLs
+SHARD_SELF = os.environ.get("SHARD_SELF", "").rstrip("/")  # this process's URL in SHARDS (shard mode)
+SHARD_ROUTER = os.environ.get("SHARD_ROUTER", "0") == "1"  # route requests to SHARDS instead of serving
+SHARD_VNODES = 64  # ring points per shard
+SHARD_MIGRATION_BATCH = 500  # keys handed over per migration step
+CLUSTER_FILE = "cluster.json"  # ring (+ ring being migrated from) as last changed; takes precedence over SHARDS
+REFRESH_WRITE_WINDOW = 5  # seconds; refreshes closer than this to last_check are answered without a write
+KEY_LOCK_STRIPES = 256  # verify evaluations of the same key are serialized on one of these
+MAX_SEATS = 10000  # upper bound for a multi-seat license
+LEASE_SECRET = os.environ.get("LEASE_SECRET", app.secret_key).encode()  # signs lease handles; same on every node
+HEARTBEAT_UDP_PORT = int(os.environ.get("HEARTBEAT_UDP_PORT", 0))  # 0 disables the UDP heartbeat listener
+VERIFY_CONCURRENCY = 16  # verifies / heartbeats evaluated at once; the rest queue
+VERIFY_QUEUE_SIZE = 256  # waiting requests beyond this are shed (new activations first)
+VERIFY_LATENCY_TARGET = 0.25  # seconds of queueing an activation may see; above it activations are deferred
+REFRESH_MAX_WAIT = 2  # seconds a refresh of a held lease may queue before it is shed
+SHED_RETRY_AFTER = 5  # base Retry-After (seconds) for deferred activations, jittered up to 2x
+VERIFY_BATCH_MAX = 64  # checks per /verify/batch request (one host process, many plugins)
+KEY_PREFIX = "L1-"  # versioned key format: prefix + plugin tag (3) + random (10) + checksum (3)
+KEY_FILTER_FP_RATE = 0.001  # Bloom filter false-positive rate in front of the store
+KEY_FILTER_MIN_CAPACITY = 100000
+ARCHIVE_FILE = "archive.db"  # cold tier (SQLite) for long-expired and dormant licenses
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 0))  # opt-in: expired / idle this long -> archived (e.g. 180)
+ARCHIVE_INTERVAL = 3600  # seconds between archival sweeps
+ARCHIVE_BATCH = 5000  # licenses moved per transaction + save
+EXPIRY_WARNING_DAYS = 7  # dashboard warning tier + renewal reminder window
+EXPIRY_CHECK_INTERVAL = 60  # max seconds between expiry sweeps
+EXPIRY_EVENT_LOG = 1000  # recent expiry events kept in memory
+EXPIRY_BATCH = 1000  # deadlines handled per lock hold + save
+SEARCH_NGRAM = 3  # substring index granularity (shorter queries match prefixes only)
+SEARCH_PAGE_SIZE = 50
+ADMIN_PAGE_SIZE = 100  # dashboard rows per page
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)  # seconds
+REQUEST_TIMING = os.environ.get("REQUEST_TIMING", "0") == "1"  # per-phase timings (toggle via /timing)
+SLOW_REQUEST_MS = 250  # requests slower than this land in the slow-request log
+SLOW_LOG_SIZE = 200
+PROFILE_INTERVAL = 0.005  # sampling profiler period (seconds)
+PROFILE_MAX_SECONDS = 300
+CAPTURE = os.environ.get("CAPTURE", "0") == "1"  # record anonymized verify / admin traffic (toggle via /capture)
+CAPTURE_FILE = os.environ.get("CAPTURE_FILE", "capture.jsonl")  # append-only; replay with replay_capture.py
+CAPTURE_SALT = os.environ.get("CAPTURE_SALT", "").encode() or secrets.token_bytes(16)  # keys / user_ids -> HMAC ids
+CAPTURE_BUFFER = 65536  # records waiting for the writer; beyond this they are dropped
+
+# ==========================
+# 🕰 CLOCK
+# ==========================
+# Every license / lease / expiry decision reads the time from `clock`, so tests and the lease
+# simulator can swap in a VirtualClock and run days of heartbeats in seconds. Request timing,
+# the scheduler and other operational timestamps stay on the real clock.
+class Clock:
+    def now(self):
+        return datetime.now()
+
+    def time(self):
+        return time.time()
+
+class VirtualClock(Clock):
+    def __init__(self, start):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def time(self):
+        return self.current.timestamp()
+
+    def advance(self, seconds):
+        self.current += timedelta(seconds=seconds)
+
+clock = Clock()
+
+# ==========================
+# 📈 METRICS
+# ==========================
+metrics_lock = threading.Lock()
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(METRICS_BUCKETS) + 1)  # last slot = +Inf
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(METRICS_BUCKETS, seconds)
+        with metrics_lock:
+            self.counts[i] += 1
+            self.sum += seconds
+
+    def render(self, name, labels):
+        lines, total = [], 0
+        for le, n in zip(METRICS_BUCKETS + ("+Inf",), self.counts):
+            total += n
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {total}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {total}")
+        return lines
+
+request_counts = {}  # (route, method, status) -> count
+route_latency = {}  # route -> Histogram
+verify_latency = {}  # outcome -> Histogram
+persist_latency = Histogram()
+persist_stats = {"writes": 0, "bytes": 0, "last_bytes": 0}
+
+def histogram(table, label):
+    h = table.get(label)
+    if h is None:
+        with metrics_lock:
+            h = table.setdefault(label, Histogram())
+    return h
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    if REQUEST_TIMING:
+        g.phases = {}
+
+@app.after_request
+def record_request(response):
+    elapsed = time.perf_counter() - g.get("started", time.perf_counter())
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    histogram(route_latency, route).observe(elapsed)
+    outcome = g.get("verify_outcome")
+    if outcome:
+        histogram(verify_latency, outcome).observe(elapsed)
+    label = (route, request.method, response.status_code)
+    with metrics_lock:
+        request_counts[label] = request_counts.get(label, 0) + 1
+    if REQUEST_TIMING and "phases" in g:
+        finish_timing(response, elapsed)
+    return response
+
+def render_metrics():
+    with metrics_lock:
+        counts, routes, outcomes = sorted(request_counts.items()), sorted(route_latency.items()), sorted(verify_latency.items())
+    out = ["# TYPE license_http_requests_total counter"]
+    for (route, method, status), n in counts:
+        out.append(f'license_http_requests_total{{route="{route}",method="{method}",status="{status}"}} {n}')
+    out.append("# TYPE license_http_request_duration_seconds histogram")
+    for route, h in routes:
+        out += h.render("license_http_request_duration_seconds", f'route="{route}"')
+    out.append("# TYPE license_verify_duration_seconds histogram")
+    for outcome, h in outcomes:
+        out += h.render("license_verify_duration_seconds", f'outcome="{outcome}"')
+    out.append("# TYPE license_verify_coalesced_total counter")
+    out.append(f"license_verify_coalesced_total {verify_stats['coalesced']}")
+    out.append("# TYPE license_verify_filtered_total counter")
+    out.append(f"license_verify_filtered_total {verify_stats['filtered']}")
+    out.append("# TYPE license_refresh_writes_suppressed_total counter")
+    out.append(f"license_refresh_writes_suppressed_total {verify_stats['writes_suppressed']}")
+    out.append("# TYPE license_lease_heartbeats_total counter")
+    out += [f'license_lease_heartbeats_total{{result="{r}"}} {n}' for r, n in sorted(heartbeat_stats.items())]
+    out.append("# TYPE license_verify_shed_total counter")
+    out += [f'license_verify_shed_total{{priority="{p}"}} {n}' for p, n in zip(("activation", "refresh"), admission.shed)]
+    out.append("# TYPE license_admission_queue gauge")
+    out.append(f"license_admission_queue {len(admission.queues[0]) + len(admission.queues[1])}")
+    out.append("# TYPE license_admission_delay_seconds gauge")
+    out.append(f"license_admission_delay_seconds {admission.delay}")
+    out.append("# TYPE license_persist_duration_seconds histogram")
+    out += persist_latency.render("license_persist_duration_seconds", "")
+    out.append("# TYPE license_persist_writes_total counter")
+    out.append(f"license_persist_writes_total {persist_stats['writes']}")
+    out.append("# TYPE license_persist_bytes_total counter")
+    out.append(f"license_persist_bytes_total {persist_stats['bytes']}")
+    out.append("# TYPE license_persist_last_bytes gauge")
+    out.append(f"license_persist_last_bytes {persist_stats['last_bytes']}")
+    out.append("# TYPE license_audit_events_written_total counter")
+    out.append(f"license_audit_events_written_total {audit_stats['written']}")
+    out.append("# TYPE license_audit_events_dropped_total counter")
+    out.append(f"license_audit_events_dropped_total {audit_ring.dropped}")
+    tasks = list(scheduler.tasks.values())
+    out.append("# TYPE license_task_runs_total counter")
+    out += [f'license_task_runs_total{{task="{t.name}"}} {t.runs}' for t in tasks]
+    out.append("# TYPE license_task_failures_total counter")
+    out += [f'license_task_failures_total{{task="{t.name}"}} {t.failures}' for t in tasks]
+    out.append("# TYPE license_task_overruns_total counter")
+    out += [f'license_task_overruns_total{{task="{t.name}"}} {t.overruns}' for t in tasks]
+    out.append("# TYPE license_task_last_duration_seconds gauge")
+    out += [f'license_task_last_duration_seconds{{task="{t.name}"}} {t.last_duration}' for t in tasks]
+    out.append("# TYPE license_licenses gauge")
+    out.append(f"license_licenses {len(licenses)}")
+    out.append("# TYPE license_bound_leases gauge")
+    out.append(f"license_bound_leases {len(bound_keys)}")
+    out.append("# TYPE license_seat_leases gauge")
+    out.append(f"license_seat_leases {sum(seat_counts.values())}")
+    return "\n".join(out) + "\n"
+
+# ==========================
+# ⏱ REQUEST TIMING & PROFILER
+# ==========================
+slow_requests = deque(maxlen=SLOW_LOG_SIZE)
+
+class PhaseTimer:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        phases = g.get("phases") if has_request_context() else None
+        if phases is not None:
+            phases[self.name] = phases.get(self.name, 0) + time.perf_counter() - self.started
+
+class NoPhase:
+    def __enter__(self): pass
+    def __exit__(self, *exc): pass
+
+NO_PHASE = NoPhase()
+
+# `with phase("persist"):` -> adds to this request's phase timings; a shared no-op when timing is off
+def phase(name):
+    return PhaseTimer(name) if REQUEST_TIMING else NO_PHASE
+
+def finish_timing(response, elapsed):
+    phases = {name: round(s * 1000, 3) for name, s in g.phases.items()}
+    total = round(elapsed * 1000, 3)
+    response.headers["Server-Timing"] = ", ".join(
+        [f"{name};dur={ms}" for name, ms in phases.items()] + [f"total;dur={total}"])
+    if total >= SLOW_REQUEST_MS:
+        entry = {
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": total,
+            "phases_ms": phases
+        }
+        slow_requests.append(entry)
+        print(f"[SLOW] {request.method} {request.path} {total}ms {phases}")
+
+profiler = {"thread": None, "stop": threading.Event(), "stacks": {}, "samples": 0, "started": None, "seconds": 0}
+profile_lock = threading.Lock()  # stacks are read by /profile while the sampler adds to them
+
+# Samples every other thread's stack; output is the collapsed "a;b;c count" format flamegraph tools read
+def profile_sampler(seconds, stop, stacks):
+    me = threading.get_ident()
+    deadline = time.perf_counter() + seconds
+    while not stop.is_set() and time.perf_counter() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        sample = []
+        for tid, frame in sys._current_frames().items():
+            if tid == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                frame = frame.f_back
+            stack.append(names.get(tid, str(tid)))
+            sample.append(";".join(reversed(stack)))
+        with profile_lock:
+            for folded in sample:
+                stacks[folded] = stacks.get(folded, 0) + 1
+        profiler["samples"] += 1
+        stop.wait(PROFILE_INTERVAL)
+
+def profile_report():
+    with profile_lock:
+        items = list(profiler["stacks"].items())
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(items))
+
+# ==========================
+# 🗂 CATALOG STORAGE (memory-mapped, lazily decoded)
+# ==========================
+# File layout: header | records (compact JSON, no key) | index sorted by key
+# (key NUL-padded to key_width, u64 offset, u32 length) -> O(log n) lookups straight from the mmap
+CATALOG_MAGIC = b"LCAT0001"
+CATALOG_HEADER = struct.Struct("<8sQIIQ")  # magic, count, key_width, reserved, index_offset
+CATALOG_ENTRY = struct.Struct("<QI")  # record offset, record length
+
+class LicenseCatalog(MutableMapping):
+    def __init__(self, path):
+        self.path = path
+        self.hot = {}  # decoded records (authoritative once decoded, may be mutated in place)
+        self.added = {}  # keys not in the mapped file yet (insertion ordered)
+        self.deleted = set()  # mapped keys removed since the last save
+        self.open()
+
+    def open(self):
+        disk = (None, 0, 0, 0)
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= CATALOG_HEADER.size:
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, count, width, _, index_offset = CATALOG_HEADER.unpack_from(mm, 0)
+            if magic != CATALOG_MAGIC:
+                raise ValueError(f"{self.path} is not a license catalog")
+            disk = (mm, count, width, index_offset)
+        self.disk = disk  # swapped as one tuple so readers never mix two files
+
+    def locate(self, key):
+        mm, count, width, base = self.disk
+        k = key.encode()
+        if not count or len(k) > width:
+            return None
+        k = k.ljust(width, b"\0")
+        step = width + CATALOG_ENTRY.size
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = base + mid * step
+            cur = mm[pos:pos + width]
+            if cur < k: lo = mid + 1
+            elif cur > k: hi = mid
+            else:
+                offset, length = CATALOG_ENTRY.unpack_from(mm, pos + width)
+                return mm[offset:offset + length]
+        return None
+
+    def __getitem__(self, key):
+        record = self.hot.get(key)
+        if record is not None:
+            return record
+        raw = None if key in self.deleted else self.locate(key)
+        if raw is None:
+            raise KeyError(key)
+        return self.hot.setdefault(key, json.loads(raw))
+
+    def __contains__(self, key):
+        if key in self.hot:
+            return True
+        return key not in self.deleted and self.locate(key) is not None
+
+    def __setitem__(self, key, record):
+        if key in self.deleted:
+            self.deleted.discard(key)
+        elif key not in self.hot and self.locate(key) is None:
+            self.added[key] = None
+        self.hot[key] = record
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.hot.pop(key, None)
+        if key in self.added:
+            del self.added[key]
+        else:
+            self.deleted.add(key)
+
+    def __iter__(self):
+        mm, count, width, base = self.disk
+        step = width + CATALOG_ENTRY.size
+        for pos in range(base, base + count * step, step):
+            key = mm[pos:pos + width].rstrip(b"\0").decode()
+            if key not in self.deleted:
+                yield key
+        yield from list(self.added)
+
+    def __len__(self):
+        return self.disk[1] - len(self.deleted) + len(self.added)
+
+    # Read-only scan: records that were never touched are decoded without being pinned in memory
+    def items(self):
+        for key in self:
+            record = self.hot.get(key)
+            if record is None:
+                raw = self.locate(key)
+                if raw is None:
+                    continue
+                record = json.loads(raw)
+            yield key, record
+
+    # Rewrites the file in key order (mapped index merged with new keys); untouched records
+    # are copied as raw byte runs, only decoded ones are re-encoded
+    def save(self):
+        mm, count, width, base = self.disk
+        step = width + CATALOG_ENTRY.size
+        mapped = ((mm[pos:pos + width].rstrip(b"\0").decode(), pos) for pos in range(base, base + count * step, step))
+        merged = heapq.merge(mapped, ((k, None) for k in sorted(self.added)))
+        tmp = self.path + ".tmp"
+        keys, offsets, lengths = [], [], []
+        with open(tmp, "wb") as f:
+            f.write(bytes(CATALOG_HEADER.size))
+            offset = CATALOG_HEADER.size
+            run_start = run_end = None  # pending run of untouched bytes in the old file
+            for key, pos in merged:
+                if pos is not None and key in self.deleted:
+                    continue
+                record = self.hot.get(key)
+                if record is None:
+                    old, length = CATALOG_ENTRY.unpack_from(mm, pos + width)
+                    if run_end != old:
+                        if run_start is not None:
+                            f.write(mm[run_start:run_end])
+                        run_start = old
+                    run_end = old + length
+                else:
+                    if run_start is not None:
+                        f.write(mm[run_start:run_end])
+                        run_start = run_end = None
+                    raw = json.dumps(record, separators=(",", ":")).encode()
+                    f.write(raw)
+                    length = len(raw)
+                keys.append(key.encode())
+                offsets.append(offset)
+                lengths.append(length)
+                offset += length
+            if run_start is not None:
+                f.write(mm[run_start:run_end])
+            new_width = max(map(len, keys), default=0)
+            f.write(b"".join(k.ljust(new_width, b"\0") + CATALOG_ENTRY.pack(o, n) for k, o, n in zip(keys, offsets, lengths)))
+            f.seek(0)
+            f.write(CATALOG_HEADER.pack(CATALOG_MAGIC, len(keys), new_width, 0, offset))
+        os.replace(tmp, self.path)
+        self.added.clear()
+        self.deleted.clear()
+        self.open()
+        return offset + len(keys) * (new_width + CATALOG_ENTRY.size)
+
+# ==========================
+# 🗓 BACKGROUND SCHEDULER
+# ==========================
+class Task:
+    def __init__(self, name, fn, interval, jitter, timeout):
+        self.name, self.fn, self.interval, self.jitter, self.timeout = name, fn, interval, jitter, timeout
+        self.next_run = 0.0
+        self.running_since = None
+        self.timed_out = False
+        self.runs = self.failures = self.overruns = self.timeouts = 0
+        self.last_run = self.last_error = None
+        self.last_duration = self.max_duration = 0.0
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "overruns": self.overruns,
+            "timeouts": self.timeouts,
+            "running": self.running_since is not None,
+            "last_run": self.last_run,
+            "last_duration": round(self.last_duration, 6),
+            "max_duration": round(self.max_duration, 6),
+            "last_error": self.last_error,
+            "next_run_in": round(max(self.next_run - time.monotonic(), 0), 3)
+        }
+
+# Runs periodic (interval) and delayed one-shot (interval=None) tasks on a small pool.
+# A run still going when the next is due counts as an overrun and that run is skipped;
+# Python threads cannot be killed, so a timeout is reported rather than enforced.
+class Scheduler:
+    def __init__(self, workers):
+        self.workers = workers
+        self.tasks = {}
+        self.cond = threading.Condition()
+        self.pool = None
+        self.thread = None
+        self.stopping = False
+        self.stop_hooks = []
+
+    def every(self, name, interval, fn, jitter=TASK_JITTER, timeout=None, delay=None):
+        task = Task(name, fn, interval, jitter, timeout or interval)
+        with self.cond:
+            task.next_run = time.monotonic() + (self.jittered(task) if delay is None else delay)
+            self.tasks[name] = task
+            self.cond.notify()
+        return task
+
+    def after(self, name, delay, fn, timeout=None):
+        task = Task(name, fn, None, 0, timeout)
+        with self.cond:
+            task.next_run = time.monotonic() + delay
+            self.tasks[name] = task
+            self.cond.notify()
+        return task
+
+    def wake(self, name):
+        with self.cond:
+            task = self.tasks.get(name)
+            if task is not None and task.next_run > time.monotonic():
+                task.next_run = time.monotonic()
+                self.cond.notify()
+
+    def on_stop(self, fn):
+        self.stop_hooks.append(fn)
+
+    def jittered(self, task):
+        return task.interval * (1 + random.uniform(-task.jitter, task.jitter))
+
+    def start(self):
+        with self.cond:
+            if self.thread is not None:
+                return  # already started (import + __main__, or a second caller)
+            self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="task")
+            self.thread = threading.Thread(target=self.loop, daemon=True, name="scheduler")
+            self.thread.start()
+
+    def loop(self):
+        with self.cond:
+            while not self.stopping:
+                now = time.monotonic()
+                for task in list(self.tasks.values()):
+                    if task.running_since is not None and not task.timed_out and task.timeout \
+                            and now - task.running_since > task.timeout:
+                        task.timed_out = True
+                        task.timeouts += 1
+                        print(f"[SCHEDULER] {task.name} exceeded its {task.timeout}s timeout")
+                    if task.next_run > now:
+                        continue
+                    if task.interval is None:
+                        del self.tasks[task.name]
+                    else:
+                        task.next_run = now + self.jittered(task)
+                    if task.running_since is not None:
+                        task.overruns += 1
+                        print(f"[SCHEDULER] {task.name} still running, skipping this run")
+                        continue
+                    task.running_since = now
+                    self.pool.submit(self.execute, task)
+                upcoming = [t.next_run for t in self.tasks.values()]
+                upcoming += [t.running_since + t.timeout for t in self.tasks.values()
+                             if t.running_since is not None and t.timeout and not t.timed_out]
+                self.cond.wait(max(min(upcoming, default=now + 60) - time.monotonic(), 0.01))
+
+    def execute(self, task):
+        started = time.perf_counter()
+        task.last_run = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            task.fn()
+            task.last_error = None
+        except Exception as e:
+            task.failures += 1
+            task.last_error = repr(e)
+            print(f"[SCHEDULER] {task.name} failed:", e)
+        finally:
+            task.last_duration = time.perf_counter() - started
+            task.max_duration = max(task.max_duration, task.last_duration)
+            task.runs += 1
+            with self.cond:
+                task.running_since = None
+                task.timed_out = False
+                self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            if self.stopping:
+                return
+            self.stopping = True
+            self.cond.notify()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+        for fn in self.stop_hooks:
+            try:
+                fn()
+            except Exception as e:
+                print("[SCHEDULER] Shutdown hook failed:", e)
+
+scheduler = Scheduler(SCHEDULER_WORKERS)
+
+# Shared pooled session for every outbound request (keep-alive pings, peers, ...)
+http = requests.Session()
+http.mount("http://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+http.mount("https://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+
+# ==========================
+# 📜 AUDIT LOG
+# ==========================
+# Producers claim a slot with next() on an itertools.count (atomic under the GIL) and write
+# (seq, event) into it; a single writer drains slots in sequence order. Nothing on the request
+# path takes a lock or touches the disk.
+class AuditRing:
+    def __init__(self, size):
+        self.size, self.mask = size, size - 1
+        self.slots = [None] * size
+        self.counter = itertools.count()
+        self.head = 0  # approximate claimed position (overflow check only)
+        self.read = 0  # next sequence number the writer expects
+        self.dropped = 0
+
+    def push(self, event):
+        if self.head - self.read >= self.size:
+            self.dropped += 1
+            return False
+        seq = next(self.counter)
+        self.slots[seq & self.mask] = (seq, event)
+        self.head = seq + 1
+        return True
+
+    def drain(self):
+        batch = []
+        while True:
+            slot = self.slots[self.read & self.mask]
+            if slot is None or slot[0] < self.read:
+                return batch  # not written yet
+            if slot[0] > self.read:
+                self.dropped += 1  # overwritten by a producer that raced past the overflow check
+            else:
+                batch.append(slot[1])
+            self.read += 1
+
+audit_ring = AuditRing(AUDIT_BUFFER)
+audit_recent = deque(maxlen=AUDIT_RECENT)
+audit_stats = {"written": 0, "bytes": 0}
+
+def audit(event, key, user_id=None, **extra):
+    audit_ring.push((clock.time(), event, key, user_id, extra or None))
+
+def audit_record(item):
+    ts, event, key, user_id, extra = item
+    record = {"time": datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"), "event": event, "key": key}
+    if user_id is not None:
+        record["user_id"] = user_id
+    if extra:
+        record.update(extra)
+    return record
+
+def rotate_audit(path):
+    for i in range(AUDIT_KEEP_FILES - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+
+def flush_audit():
+    batch = audit_ring.drain()
+    if not batch:
+        return
+    records = [audit_record(item) for item in batch]
+    data = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records).encode()
+    os.makedirs(AUDIT_DIR, exist_ok=True)
+    path = os.path.join(AUDIT_DIR, "audit.log")
+    with open(path, "ab") as f:
+        f.write(data)
+        size = f.tell()
+    if size >= AUDIT_FILE_BYTES:
+        rotate_audit(path)
+    audit_recent.extend(records)
+    audit_stats["written"] += len(records)
+    audit_stats["bytes"] += len(data)
+
+scheduler.every("audit-flush", AUDIT_FLUSH_INTERVAL, flush_audit, jitter=0)
+scheduler.on_stop(flush_audit)
+
+# ==========================
+# 🎥 TRAFFIC CAPTURE
+# ==========================
+# Opt-in recording of /verify, /verify/batch, lease heartbeats and admin calls, one compact JSON
+# array per line. Keys, user_ids and plugin names are replaced by salted HMAC ids (stable for a
+# given CAPTURE_SALT), times are ms since the session header, latencies are in microseconds:
+#   {"capture": 1, "started": <epoch>}                                     session header
+#   [ms, "v"|"b", key, user, plugin, status, outcome, latency_us, seats]   verify / batch check
+#   [ms, "h", key, seat, status, outcome, latency_us]                      lease heartbeat
+#   [ms, "a", method, endpoint, key, args, status, latency_us, new_key]    admin request
+# Same producer / writer split as the audit log: the request path only appends to a deque.
+CAPTURE_ADMIN_ENDPOINTS = {"generate_license", "extend_license", "expire_license", "unbind_license", "set_seats",
+                           "delete_license", "backup", "changes", "search", "stats", "expiring_licenses",
+                           "admin_dashboard", "archive_search", "archive_restore", "list_plugins", "update_plugin"}
+CAPTURE_NUMERIC_ARGS = {"days", "seats", "page", "since"}  # kept as integers
+CAPTURE_ARGS = CAPTURE_NUMERIC_ARGS | {"plugin", "user", "user_id", "q"}  # always hashed; other args are dropped
+capture_buffer = deque()
+capture = {"started": None, "records": 0, "dropped": 0, "bytes": 0}
+
+def capture_id(value):
+    if value is None or value == "":
+        return None
+    digest = hmac.new(CAPTURE_SALT, str(value).encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:6]).decode()
+
+def start_capture():
+    capture["started"] = time.perf_counter(), time.time()
+    capture_buffer.append({"capture": 1, "started": round(capture["started"][1], 3)})
+
+def capture_args(args):
+    kept = {}
+    for name in CAPTURE_ARGS & args.keys():
+        value = args[name]
+        if name not in CAPTURE_NUMERIC_ARGS:
+            kept[name] = capture_id(value.strip().lower())
+        elif value.isdigit():
+            kept[name] = int(value)
+    return kept or None
+
+@app.after_request
+def capture_request(response):
+    if not CAPTURE or request.endpoint is None:
+        return response
+    if len(capture_buffer) >= CAPTURE_BUFFER:
+        capture["dropped"] += 1
+        return response
+    now = time.perf_counter()
+    ms = int((now - capture["started"][0]) * 1000)
+    latency = int((now - g.get("started", now)) * 1e6)
+    status = response.status_code
+    if request.endpoint == "verify_license":
+        args = request.args
+        seats = (response.get_json(silent=True) or {}).get("seats") if status == 200 else None
+        capture_buffer.append([ms, "v", capture_id(args.get("key")), capture_id(args.get("user_id")),
+                               capture_id(args.get("plugin", "").strip().lower()), status,
+                               g.get("verify_outcome"), latency, seats])
+    elif request.endpoint == "verify_batch":
+        checks = g.get("batch_results") or [(c, g.get("verify_outcome"), status, None) for c in batch_checks() or ()]
+        for check, outcome, code, seats in checks:
+            capture_buffer.append([ms, "b", capture_id(check.get("key")), capture_id(check.get("user_id")),
+                                   capture_id(str(check.get("plugin") or "").strip().lower()), code, outcome,
+                                   latency, seats])
+    elif request.endpoint == "lease_heartbeat":
+        key, seat, _ = (request.view_args["handle"].rsplit(".", 2) + ["", ""])[:3]  # same split as refresh_lease
+        capture_buffer.append([ms, "h", capture_id(key), int(seat) if seat.isdigit() else None, status,
+                               g.get("verify_outcome"), latency])
+    elif request.endpoint in CAPTURE_ADMIN_ENDPOINTS:
+        new_key = (response.get_json(silent=True) or {}).get("key") \
+            if request.endpoint == "generate_license" and response.is_json else None
+        key = request.args.get("key") if request.endpoint != "generate_license" else None
+        capture_buffer.append([ms, "a", request.method, request.endpoint, capture_id(key),
+                               capture_args(request.args), status, latency, capture_id(new_key)])
+    return response
+
+def flush_capture():
+    batch = []
+    while capture_buffer:
+        batch.append(capture_buffer.popleft())
+    if not batch:
+        return
+    data = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in batch).encode()
+    with open(CAPTURE_FILE, "ab") as f:
+        f.write(data)
+    capture["records"] += len(batch)
+    capture["bytes"] += len(data)
+
+if CAPTURE:
+    start_capture()
+scheduler.every("capture-flush", AUDIT_FLUSH_INTERVAL, flush_capture, jitter=0)
+scheduler.on_stop(flush_capture)
+
+# ==========================
+# 🧩 PLUGIN REGISTRY
+# ==========================
+# Records reference plugins by integer "plugin_id"; the registry holds the interned canonical name
+# (stripped, lower-case), the display name and the per-plugin policy. A policy value of None falls
+# back to the global setting. Records also keep the canonical name in "plugin": it is the source of
+# truth, so a lost or replaced plugins.json is rebuilt from the store instead of unbinding plugins.
+class Plugin:
+    __slots__ = ("id", "name", "canonical", "heartbeat_timeout", "default_expiry_days", "rate_limit")
+    POLICY = ("heartbeat_timeout", "default_expiry_days", "rate_limit")  # rate_limit = verifies/minute per key
+
+    def __init__(self, id, name, heartbeat_timeout=None, default_expiry_days=None, rate_limit=None):
+        self.id, self.name = id, name
+        self.canonical = sys.intern(name.strip().lower())
+        self.heartbeat_timeout, self.default_expiry_days, self.rate_limit = heartbeat_timeout, default_expiry_days, rate_limit
+
+    def as_dict(self):
+        return {"id": self.id, "name": self.name, **{p: getattr(self, p) for p in self.POLICY}}
+
+plugins = {}  # id -> Plugin
+plugin_ids = {}  # canonical name -> id
+plugin_aliases = {}  # raw incoming name -> id
+plugin_registry = {"next_id": 1, "revision": 0}  # revision bumped on every registry change (followers compare it)
+plugins_lock = threading.RLock()
+
+def load_plugin_registry(data):
+    with plugins_lock:
+        plugins.clear(); plugin_ids.clear(); plugin_aliases.clear()
+        for entry in data.get("plugins", []):
+            plugin = Plugin(**entry)
+            plugins[plugin.id] = plugin
+            plugin_ids[plugin.canonical] = plugin.id
+        plugin_registry.update(next_id=data.get("next_id", 1), revision=data.get("revision", 0))
+
+def plugin_registry_dump():
+    with plugins_lock:
+        return dict(plugin_registry, plugins=[p.as_dict() for p in plugins.values()])
+
+def save_plugins():
+    with plugins_lock:
+        with open(PLUGINS_FILE, "w") as f:
+            json.dump(plugin_registry_dump(), f, indent=2)
+
+# Returns the Plugin for a name, registering it on first sight (None for an empty name)
+def register_plugin(name, save=True):
+    canonical = (name or "").strip().lower()
+    if not canonical:
+        return None
+    pid = plugin_ids.get(canonical)
+    if pid is not None:
+        return plugins[pid]
+    with plugins_lock:
+        pid = plugin_ids.get(canonical)
+        if pid is None:
+            pid = plugin_registry["next_id"]
+            plugins[pid] = Plugin(pid, name.strip())
+            plugin_ids[plugins[pid].canonical] = pid
+            plugin_registry["next_id"] += 1
+            plugin_registry["revision"] += 1
+            if save:
+                save_plugins()
+        return plugins[pid]
+
+# Id of a plugin name sent by a client; 0 when no such plugin is registered
+def incoming_plugin_id(name):
+    pid = plugin_aliases.get(name)
+    if pid is None:
+        pid = plugin_ids.get(name.strip().lower(), 0)
+        if pid and len(plugin_aliases) < PLUGIN_ALIAS_CACHE:
+            plugin_aliases[name] = pid
+    return pid
+
+# Resolves the record's plugin name to this registry's id in place and interns its user string.
+# Records that only carry a "plugin_id" keep it and get the name when the registry knows the id.
+def normalize_record(info, save=True):
+    if isinstance(info.get("plugin"), str):
+        plugin = register_plugin(info["plugin"], save)
+        info["plugin"] = plugin.canonical if plugin else ""
+        info["plugin_id"] = plugin.id if plugin else None
+    elif info.get("plugin_id") in plugins:
+        info["plugin"] = plugins[info["plugin_id"]].canonical
+    if isinstance(info.get("user"), str):
+        info["user"] = sys.intern(info["user"])
+    return info
+
+def plugin_of(info):
+    plugin = plugins.get(info.get("plugin_id"))
+    if plugin is None or plugin.canonical != info.get("plugin", plugin.canonical):
+        normalize_record(info)  # lazily decoded catalog records, or ids from another registry
+        plugin = plugins.get(info.get("plugin_id"))
+    return plugin
+
+# A plugin_id with neither a registry entry nor a name: the license can't be matched to its plugin
+def plugin_unknown(info):
+    return info.get("plugin_id") is not None and plugin_of(info) is None
+
+def plugin_label(info):
+    plugin = plugin_of(info)
+    return plugin.name if plugin else ""
+
+def heartbeat_timeout(info):
+    plugin = plugin_of(info)
+    return plugin.heartbeat_timeout if plugin and plugin.heartbeat_timeout else HEARTBEAT_TIMEOUT
+
+# Record as shown to admins / moved between shards: plugin by name (ids are per-registry)
+def portable_record(info):
+    record = dict(info, plugin=plugin_label(info))
+    record.pop("plugin_id", None)
+    return record
+
+if os.path.exists(PLUGINS_FILE):
+    with open(PLUGINS_FILE, "r") as f:
+        load_plugin_registry(json.load(f))
 
 # ==========================
 # 🧾 DATA HANDLING
 # ==========================
-if os.path.exists(DATA_FILE):
+if STORAGE_FORMAT == "catalog":
+    licenses = LicenseCatalog(CATALOG_FILE)
+    if not os.path.exists(CATALOG_FILE) and os.path.exists(DATA_FILE):
+        with open(DATA_FILE, "r") as f:
+            licenses.update(json.load(f))  # one-time migration from licenses.json
+        licenses.save()
+elif os.path.exists(DATA_FILE):
     with open(DATA_FILE, "r") as f:
         licenses = json.load(f)
+    revision = plugin_registry["revision"]
+    for info in licenses.values():
+        normalize_record(info, save=False)
+    unknown = sum(1 for info in licenses.values() if plugin_unknown(info))
+    if unknown:
+        raise SystemExit(f"[PLUGINS] {unknown} licenses reference plugin ids missing from {PLUGINS_FILE}; "
+                         f"restore {PLUGINS_FILE} from a backup before starting")
+    if plugin_registry["revision"] != revision:
+        save_plugins()  # records are rewritten in the new layout on the next save
 else:
     licenses = {}
 
 def save_licenses():
-    with open(DATA_FILE, "w") as f:
-        json.dump(licenses, f, indent=2)
+    started = time.perf_counter()
+    with phase("persist"), licenses_lock:
+        if isinstance(licenses, LicenseCatalog):
+            size = licenses.save()
+        else:
+            with open(DATA_FILE, "w") as f:
+                json.dump(licenses, f, indent=2)
+                size = f.tell()
+    persist_latency.observe(time.perf_counter() - started)
+    with metrics_lock:
+        persist_stats["writes"] += 1
+        persist_stats["bytes"] += size
+        persist_stats["last_bytes"] = size
+
+def generate_key(plugin_name=None):
+    body = KEY_PREFIX + plugin_tag(plugin_name) + "".join(secrets.choice(KEY_ALPHABET) for _ in range(10))
+    return body + key_checksum(body)
+
+licenses_lock = threading.RLock()
+bound_keys = set()  # keys currently bound to a user_id (or holding at least one seat)
+seat_counts = {}  # multi-seat key -> seats currently leased
+index_build = {"running": False, "dirty": set()}
+
+# Call after any change to a license record (or its removal) so indexes stay in sync
+def license_changed(key, version=None, archived=None):
+    record_mutation(key, version, archived)
+    remember_key(key)
+    if index_build["running"]:
+        with licenses_lock:
+            if index_build["running"]:
+                index_build["dirty"].add(key)  # replayed once the bulk build swaps in
+                return
+    index_expiry(key)
+    index_search(key)
+    track_binding(key)
+
+def track_binding(key):
+    info = licenses.get(key)
+    if info is not None and (info.get("bound_to") or info.get("leases")):
+        bound_keys.add(key)
+    else:
+        bound_keys.discard(key)
+    if info is not None and info.get("leases"):
+        seat_counts[key] = len(info["leases"])
+    else:
+        seat_counts.pop(key, None)
+    if info is None:
+        seat_pools.pop(key, None)
+
+# ==========================
+# 🧷 KEY FORMAT & NEGATIVE FILTER
+# ==========================
+# New keys look like L1-TTTRRRRRRRRRRCCC (Crockford base32): TTT tags the plugin (hash of its canonical
+# name, stable across shards), CCC is a checksum of everything before it, so a malformed key is
+# rejected without touching storage. A Bloom filter over every key in the store (legacy and custom
+# keys included) answers "certainly not issued" for the rest. Deleted keys linger in the filter until
+# the next rebuild, which only costs a real lookup.
+KEY_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+KEY_CHARS = frozenset(KEY_ALPHABET)
+
+def base32(value, width):
+    return "".join(KEY_ALPHABET[(value >> (5 * i)) & 31] for i in reversed(range(width)))
+
+def key_checksum(body):
+    return base32(int.from_bytes(hashlib.blake2b(body.encode(), digest_size=4).digest(), "big"), 3)
+
+def plugin_tag(plugin_name):
+    canonical = (plugin_name or "").strip().lower()
+    if not canonical:
+        return "000"
+    return base32(int.from_bytes(hashlib.blake2b(canonical.encode(), digest_size=4).digest(), "big"), 3)
+
+# False for a key in the versioned format whose structure or checksum is wrong; legacy keys pass
+def key_format_ok(key):
+    if not key.startswith(KEY_PREFIX):
+        return True
+    body = key[len(KEY_PREFIX):]
+    return len(body) == 16 and KEY_CHARS.issuperset(body) and body[13:] == key_checksum(key[:-3])
+
+class BloomFilter:
+    def __init__(self, capacity, fp_rate=KEY_FILTER_FP_RATE):
+        self.capacity = capacity
+        self.size = max(int(-capacity * math.log(fp_rate) / math.log(2) ** 2), 64)  # bits
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    # count = distinct keys added (a key already present, or a false positive, is not counted again)
+    def add(self, key):
+        new = False
+        for p in self.positions(key):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                self.bits[p >> 3] |= 1 << (p & 7)
+                new = True
+        self.count += new
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self.positions(key))
+
+key_filter = {"bloom": None, "building": None, "scheduled": False}  # bloom is None until the first build finished
+key_filter_lock = threading.Lock()  # one build at a time, so a stale build can't finish last
+misformatted_keys = set()  # stored keys that use the prefix without being in the format (predate it)
+
+def remember_key(key):
+    if key.startswith(KEY_PREFIX) and not key_format_ok(key):
+        misformatted_keys.add(key)
+    for bloom in (key_filter["bloom"], key_filter["building"]):
+        if bloom is not None:
+            bloom.add(key)
+    bloom = key_filter["bloom"]
+    if bloom is not None and bloom.count > bloom.capacity and not key_filter["scheduled"]:
+        key_filter["scheduled"] = True  # outgrown: false positives climb, rebuild at twice the size
+        scheduler.after("key-filter", 0, build_key_filter, timeout=300)
+
+# Sized for twice the hot + archived keys (at least twice the outgrown filter); keys added while it
+# is built land in both filters.
+# Bulk loads that bypass license_changed (snapshots) must call this afterwards.
+def build_key_filter():
+    with key_filter_lock:
+        fill_key_filter()
+
+def fill_key_filter():
+    started = time.perf_counter()
+    old = key_filter["bloom"]
+    grown = 2 * old.capacity if old is not None and old.count > old.capacity else 0
+    fresh = BloomFilter(max(2 * (len(licenses) + (archive.count() if archive else 0)), grown, KEY_FILTER_MIN_CAPACITY))
+    key_filter["building"] = fresh
+    with licenses_lock:
+        keys = list(licenses)
+    if archive:
+        keys += archive.keys()  # archived keys stay verifiable (restored on demand)
+    for key in keys:
+        fresh.add(key)
+        if key.startswith(KEY_PREFIX) and not key_format_ok(key):
+            misformatted_keys.add(key)
+    key_filter.update(bloom=fresh, building=None, scheduled=False)
+    print(f"[KEYS] Built key filter for {len(keys)} keys in {time.perf_counter() - started:.2f}s "
+          f"({len(fresh.bits) // 1024} KiB)")
+
+# False when the key certainly was never issued here (constant time, no storage access)
+def maybe_issued(key, count=True):
+    bloom = key_filter["bloom"]
+    if bloom is None or (key in bloom if key_format_ok(key) else key in misformatted_keys):
+        return True
+    if count:
+        count_verify("filtered")
+    return False
+
+key_filter["scheduled"] = True
+scheduler.after("key-filter", 0, build_key_filter, timeout=300)
+
+# ==========================
+# ⏳ EXPIRY INDEX
+# ==========================
+expiry_index = []  # sorted [(expires, key)] -> range queries in O(log n + k)
+expiry_of = {}  # key -> expires as currently indexed
+expiry_heap = []  # [(deadline, kind, key, expires)] scheduled expiry work
+expiry_events = deque(maxlen=EXPIRY_EVENT_LOG)
+
+def day_str(dt):
+    return dt.strftime("%Y-%m-%d")
+
+def index_expiry(key):
+    with licenses_lock:
+        info = licenses.get(key)
+        if info is not None and expiry_of.get(key) == info["expires"]:
+            return
+        old = expiry_of.pop(key, None)
+        if old is not None:
+            i = bisect.bisect_left(expiry_index, (old, key))
+            if i < len(expiry_index) and expiry_index[i] == (old, key):
+                del expiry_index[i]
+        if info is None:
+            return
+        bisect.insort(expiry_index, (info["expires"], key))
+        expiry_of[key] = info["expires"]
+        if schedule_expiry(key, info, day_str(clock.now())):
+            scheduler.wake("expiry")
+
+# Queues the reminder + expiry deadlines; True if one of them is already due
+def schedule_expiry(key, info, today, heap=expiry_heap):
+    exp = info["expires"]
+    if info.get("expired"):
+        return False
+    due = exp <= today
+    if not due:
+        remind = (date.fromisoformat(exp) - timedelta(days=EXPIRY_WARNING_DAYS)).isoformat()
+        heapq.heappush(heap, (remind, "expiring", key, exp))
+        due = remind <= today
+    heapq.heappush(heap, (exp, "expired", key, exp))
+    return due
+
+# Keys whose expiry date falls in [start, stop) (date strings)
+def expiring_between(start, stop):
+    lo = bisect.bisect_left(expiry_index, (start,))
+    hi = bisect.bisect_left(expiry_index, (stop,))
+    return [k for _, k in expiry_index[lo:hi]]
+
+def emit_expiry_event(kind, key, info):
+    expiry_events.append({
+        "event": kind,
+        "key": key,
+        "user": info.get("user"),
+        "expires": info["expires"],
+        "time": clock.now().strftime("%Y-%m-%d %H:%M:%S")
+    })
+    print(f"[EXPIRY] {kind}: {key} ({info.get('user')}, expires {info['expires']})")
+
+# Pops every deadline that has passed: reminders emit events, expiries release the binding.
+# Works in batches so a long backlog never holds the lock for the whole sweep.
+def process_expiries():
+    if replication["role"] != "leader":
+        return  # the leader expires licenses and streams the result
+    today = day_str(clock.now())
+    while process_expiry_batch(today):
+        pass
+
+def process_expiry_batch(today):
+    changed = False
+    with licenses_lock:
+        for _ in range(EXPIRY_BATCH):
+            if not expiry_heap or expiry_heap[0][0] > today:
+                break
+            _, kind, key, exp = heapq.heappop(expiry_heap)
+            info = licenses.get(key)
+            if info is None or info["expires"] != exp or info.get("expired"):
+                continue  # stale entry (deleted / extended / already handled)
+            if kind == "expired":
+                if info.get("bound_to"):
+                    audit("expired", key, info["bound_to"])
+                for user_id in info.get("leases") or ():
+                    audit("expired", key, user_id)
+                if "leases" in info:
+                    info["leases"] = {}
+                info["expired"] = True
+                info["in_use"] = False
+                info["bound_to"] = None
+                info["last_check"] = None
+                license_changed(key)
+                changed = True
+            emit_expiry_event(kind, key, info)
+        if changed:
+            save_licenses()
+        return bool(expiry_heap) and expiry_heap[0][0] <= today
+
+scheduler.every("expiry", EXPIRY_CHECK_INTERVAL, process_expiries, delay=0)
+
+# ==========================
+# 🔎 SEARCH INDEX
+# ==========================
+# Keys are found by prefix only; user / plugin / bound_to also by substring. The n-gram index maps
+# grams to distinct terms (not keys), and a term's keys are its run in search_terms, so a plugin
+# name shared by 100k licenses costs a handful of set entries instead of 100k per gram.
+search_terms = []  # sorted [(term, key)] -> prefix lookups in O(log n + k)
+search_grams = {}  # n-gram -> {terms} -> substring lookups
+search_term_counts = {}  # term -> licenses carrying it (grams dropped when it reaches 0); keys excluded
+search_fields = {}  # key -> terms as currently indexed
+
+def license_terms(key, info):
+    return frozenset(str(t).lower() for t in (key, info.get("user"), plugin_label(info), info.get("bound_to")) if t)
+
+def ngrams(term):
+    return {term[i:i + SEARCH_NGRAM] for i in range(len(term) - SEARCH_NGRAM + 1)}
+
+def add_term(term, grams=search_grams, counts=search_term_counts):
+    n = counts.get(term, 0)
+    counts[term] = n + 1
+    if not n:
+        for g in ngrams(term):
+            grams.setdefault(g, set()).add(term)
+
+def drop_term(term):
+    n = search_term_counts.get(term, 0) - 1
+    if n > 0:
+        search_term_counts[term] = n
+        return
+    search_term_counts.pop(term, None)
+    for g in ngrams(term):
+        terms = search_grams.get(g)
+        if terms is not None:
+            terms.discard(term)
+            if not terms: del search_grams[g]
+
+def index_search(key):
+    with licenses_lock:
+        info = licenses.get(key)
+        new = license_terms(key, info) if info is not None else frozenset()
+        old = search_fields.get(key, frozenset())
+        if new == old:
+            return
+        own = key.lower()
+        for t in old - new:
+            i = bisect.bisect_left(search_terms, (t, key))
+            if i < len(search_terms) and search_terms[i] == (t, key):
+                del search_terms[i]
+            if t != own:
+                drop_term(t)
+        for t in new - old:
+            bisect.insort(search_terms, (t, key))
+            if t != own:
+                add_term(t)
+        if new: search_fields[key] = new
+        else: search_fields.pop(key, None)
+
+# Prefix matches first (in term order), then remaining substring matches sorted by key
+def search_licenses(query):
+    q = query.strip().lower()
+    with licenses_lock:
+        hits = {}
+        i = bisect.bisect_left(search_terms, (q,))
+        while i < len(search_terms) and search_terms[i][0].startswith(q):
+            hits.setdefault(search_terms[i][1], None)
+            i += 1
+        if len(q) >= SEARCH_NGRAM:
+            sets = sorted((search_grams.get(g, ()) for g in ngrams(q)), key=len)
+            matched = set()
+            for t in set(sets[0]).intersection(*sets[1:]) if sets else ():
+                if q in t:
+                    i = bisect.bisect_left(search_terms, (t,))
+                    while i < len(search_terms) and search_terms[i][0] == t:
+                        matched.add(search_terms[i][1])
+                        i += 1
+            for k in sorted(matched):
+                if k not in hits:
+                    hits[k] = None
+        return list(hits)
+
+# Bulk (re)build: one sort per index instead of n incremental inserts. Built off to the side
+# without holding the lock; changes made meanwhile are replayed after the swap.
+index_build_lock = threading.Lock()  # one build at a time (startup thread vs. snapshot / simulator rebuilds)
+
+def build_indexes():
+    with index_build_lock:
+        fill_indexes()
+
+def fill_indexes():
+    with licenses_lock:
+        index_build["running"] = True
+        index_build["dirty"] = set()
+        items = licenses.items() if isinstance(licenses, LicenseCatalog) else list(licenses.items())
+    started = time.perf_counter()
+    today = day_str(clock.now())
+    exp_index, exp_of, exp_heap, terms_idx, grams, counts, fields, bound, seats = [], {}, [], [], {}, {}, {}, set(), {}
+    for key, info in items:
+        exp_of[key] = info["expires"]
+        exp_index.append((info["expires"], key))
+        if info["expires"] >= today or info.get("bound_to") or info.get("leases"):
+            schedule_expiry(key, info, today, exp_heap)  # expired before this build with nothing to release: no events
+        if info.get("bound_to") or info.get("leases"):
+            bound.add(key)
+        if info.get("leases"):
+            seats[key] = len(info["leases"])
+        terms = license_terms(key, info)
+        fields[key] = terms
+        own = key.lower()
+        for t in terms:
+            terms_idx.append((t, key))
+            if t != own:
+                add_term(t, grams, counts)
+    exp_index.sort()
+    terms_idx.sort()
+    with licenses_lock:
+        for idx, fresh in ((expiry_index, exp_index), (expiry_heap, exp_heap), (search_terms, terms_idx)):
+            idx[:] = fresh
+        for idx, fresh in ((expiry_of, exp_of), (search_grams, grams), (search_term_counts, counts), (search_fields, fields)):
+            idx.clear()
+            idx.update(fresh)
+        bound_keys.clear()
+        bound_keys.update(bound)
+        seat_counts.clear()
+        seat_counts.update(seats)
+        index_build["running"] = False
+        for key in index_build["dirty"]:
+            license_changed(key)
+    scheduler.wake("expiry")
+    print(f"[INDEX] Built indexes for {len(exp_of)} licenses in {time.perf_counter() - started:.2f}s")
+
+# /verify only needs the store, so it is served right away while indexes warm up in the background
+# (search / expiry lists fill in when the build swaps in)
+threading.Thread(target=build_indexes, daemon=True, name="index-build").start()
+
+# ==========================
+# 🧊 ARCHIVE (cold tier)
+# ==========================
+# Opt-in (archived licenses leave /admin and /search; find them under /archive). Licenses expired
+# for more than ARCHIVE_AFTER_DAYS, or with no activity for that long,
+# move out of `licenses` into SQLite (one compact JSON row per key, plugin by name), so the hot set
+# and every save track active customers only. Archived keys stay in the key filter: a verify of an
+# archived expired key is answered "expired" from the archive, a dormant one is restored
+# transparently (on the leader) and verified as usual. The move is replicated as an "archived"
+# mutation, so followers keep the same cold tier.
+class ArchiveStore:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS archive (key TEXT PRIMARY KEY, user TEXT, plugin TEXT, "
+                            "expires TEXT, archived_at TEXT, reason TEXT, record TEXT) WITHOUT ROWID")
+            self.db.execute("CREATE INDEX IF NOT EXISTS archive_user ON archive (user)")
+
+    def put(self, rows):
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO archive VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT key, user, plugin, expires, archived_at, reason, record FROM archive "
+                                  "WHERE key = ?", (key,)).fetchone()
+        return archive_entry(row) if row else None
+
+    def discard(self, key):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM archive WHERE key = ?", (key,))
+
+    def keys(self):
+        with self.lock:
+            return [k for (k,) in self.db.execute("SELECT key FROM archive")]
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM archive").fetchone()[0]
+
+    # Substring match on key / user / plugin, ordered by key
+    def search(self, query, limit, offset):
+        like = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        where = "WHERE key LIKE ?1 ESCAPE '\\' OR user LIKE ?1 ESCAPE '\\' OR plugin LIKE ?1 ESCAPE '\\'"
+        with self.lock:
+            total = self.db.execute(f"SELECT COUNT(*) FROM archive {where}", (like,)).fetchone()[0]
+            rows = self.db.execute(f"SELECT key, user, plugin, expires, archived_at, reason, record FROM archive "
+                                   f"{where} ORDER BY key LIMIT ?2 OFFSET ?3", (like, limit, offset)).fetchall()
+        return total, [archive_entry(row) for row in rows]
+
+archive = ArchiveStore(ARCHIVE_FILE) if ARCHIVE_AFTER_DAYS else None
+
+def archive_entry(row):
+    key, user, plugin, expires, archived_at, reason, record = row
+    return {"key": key, "user": user, "plugin": plugin, "expires": expires, "archived_at": archived_at,
+            "reason": reason, "record": json.loads(record)}
+
+def archive_row(key, info, reason):
+    return (key, info.get("user"), plugin_label(info), info["expires"], day_str(clock.now()), reason,
+            json.dumps(portable_record(info), separators=(",", ":")))
+
+# "expired" / "dormant" when the license is due for the cold tier, else None. A binding whose
+# last heartbeat is older than the cutoff timed out long ago, so it does not keep a license hot.
+def archive_reason(info, cutoff):
+    if info["expires"] < cutoff:
+        return "expired"
+    seen = (info.get("last_check") or "")[:10] or info.get("last_seen") or info.get("created")
+    return "dormant" if seen and seen < cutoff else None
+
+def archive_licenses():
+    if replication["role"] != "leader" or SHARD_ROUTER or index_build["running"]:
+        return  # followers archive what the leader streams
+    cutoff = day_str(clock.now() - timedelta(days=ARCHIVE_AFTER_DAYS))
+    with licenses_lock:
+        keys = list(licenses)  # request threads add keys meanwhile; records are checked batch by batch
+    moved = 0
+    for i in range(0, len(keys), ARCHIVE_BATCH):
+        with licenses_lock:
+            rows = []
+            for key in keys[i:i + ARCHIVE_BATCH]:
+                info = licenses.get(key)
+                reason = archive_reason(info, cutoff) if info is not None else None
+                if reason:
+                    rows.append(archive_row(key, info, reason))
+            archive.put(rows)
+            for key, *_, reason, _ in rows:
+                del licenses[key]
+                license_changed(key, archived=reason)
+            if rows:
+                save_licenses()
+        moved += len(rows)
+    if moved:
+        audit("archived", None, count=moved, cutoff=cutoff)
+        print(f"[ARCHIVE] Moved {moved} licenses to the cold tier (cutoff {cutoff})")
+
+def restore_license(key, entry, why):
+    with licenses_lock:
+        if key in licenses:
+            return licenses[key]
+        record = normalize_record(dict(entry["record"]))
+        licenses[key] = record
+        archive.discard(key)
+        save_licenses(); license_changed(key)
+    audit("restored", key, reason=entry["reason"], by=why)
+    return record
+
+# Verify of a key that is not hot: a result to return right away, or None to carry on
+def verify_archived(key):
+    entry = archive.get(key)
+    if entry is None:
+        return None
+    if entry["expires"] < day_str(clock.now()) or entry["record"].get("expired"):
+        return "expired", {"valid": False, "reason": "expired", "user": entry["user"], "archived": True}, 200
+    if replication["role"] == "follower":
+        return "forwarded", None, 307  # the leader restores it
+    restore_license(key, entry, "verify")
+    return None
+
+if archive:
+    scheduler.every("archive", ARCHIVE_INTERVAL, archive_licenses, timeout=ARCHIVE_INTERVAL)
+
+# ==========================
+# 🔁 REPLICATION (leader -> follower)
+# ==========================
+# Every license_changed() appends (version, key, record copy) to an in-memory log. Followers take a
+# snapshot, then long-poll /replication/stream for newer versions and keep a hot copy. Followers
+# answer heartbeat refreshes and read-only admin pages themselves; claims and admin writes are
+# redirected (307) to the leader, refreshes are forwarded to it in batches.
+replication = {"role": "follower" if REPLICA_OF else "leader", "leader": REPLICA_OF, "synced": False,
+               "last_sync": None, "promoted_at": None}
+replication_log = deque(maxlen=REPLICATION_LOG_SIZE)
+replication_cond = threading.Condition()
+store = {"version": 0, "epoch": os.urandom(8).hex()}  # version bumped on every mutation; epoch per history
+heartbeat_forwards = deque()
+REPLICA_WRITE_ENDPOINTS = {"generate_license", "extend_license", "expire_license", "unbind_license", "delete_license",
+                           "set_seats", "archive_restore", "archive_run"}
+
+def record_mutation(key, version=None, archived=None):
+    info = licenses.get(key)
+    record = copy_record(info) if info is not None else {"archived": archived} if archived else None
+    with replication_cond:
+        store["version"] = version if version is not None else store["version"] + 1
+        replication_log.append((store["version"], key, record))
+        replication_cond.notify_all()
+
+def copy_record(info):
+    record = dict(info)
+    if "leases" in record:
+        record["leases"] = dict(record["leases"])  # lease entries are replaced, never mutated
+    return record
+
+def cluster_token_ok():
+    token = request.headers.get("X-Cluster-Token", "")
+    return bool(CLUSTER_TOKEN and hmac.compare_digest(token, CLUSTER_TOKEN))
+
+def cluster_headers():
+    return {"X-Cluster-Token": CLUSTER_TOKEN} if CLUSTER_TOKEN else {}
+
+@app.before_request
+def redirect_replica_writes():
+    if replication["role"] == "follower" and (request.endpoint in REPLICA_WRITE_ENDPOINTS or request.endpoint == "update_plugin"
+                                              or (request.endpoint == "verify_license" and not replication["synced"])):
+        return redirect(replication["leader"] + request.full_path, 307)
+
+def apply_snapshot(snapshot):
+    apply_plugins(snapshot["plugins"])
+    key_filter["bloom"] = None  # answer from the store until the filter covers the snapshot's keys
+    with licenses_lock:
+        for key in [k for k in licenses if k not in snapshot["licenses"]]:
+            del licenses[key]
+        licenses.update(snapshot["licenses"])
+        save_licenses()
+        with replication_cond:
+            store.update(version=snapshot["version"], epoch=snapshot["epoch"])
+            replication_log.clear()
+    build_indexes()
+    build_key_filter()
+    print(f"[REPLICA] Loaded snapshot v{snapshot['version']} ({len(snapshot['licenses'])} licenses)")
+
+def apply_plugins(registry):
+    load_plugin_registry(registry)
+    save_plugins()
+
+def apply_mutations(mutations):
+    with licenses_lock:
+        for version, key, record in mutations:
+            archived = record.get("archived") if record else None
+            if record is None or archived:
+                if key in licenses:
+                    if archived and archive:
+                        archive.put([archive_row(key, licenses[key], archived)])  # follow the leader's cold tier
+                    del licenses[key]
+            else:
+                if archive and key not in licenses:
+                    archive.discard(key)  # restored on the leader
+                licenses[key] = record
+            license_changed(key, version, archived)  # keep the leader's numbering for promotion / chaining
+        save_licenses()
+
+# Runs as a scheduler task: long-polls the leader until just before the next run is due
+def follow_leader():
+    deadline = time.monotonic() + REPLICATION_POLL_TIMEOUT - 1
+    while replication["role"] == "follower" and time.monotonic() < deadline:
+        try:
+            sync_from_leader(deadline)
+        except Exception as e:
+            print("[REPLICA] Sync failed:", e)
+            time.sleep(1)
+
+def sync_from_leader(deadline):
+    if not replication["synced"]:
+        r = http.get(replication["leader"] + "/replication/snapshot", headers=cluster_headers(), timeout=HTTP_TIMEOUT * 6)
+        r.raise_for_status()
+        apply_snapshot(r.json())
+        replication["synced"] = True
+    wait = max(min(deadline - time.monotonic(), 10), 0)
+    r = http.get(replication["leader"] + "/replication/stream", headers=cluster_headers(),
+                 params={"since": store["version"], "epoch": store["epoch"], "timeout": wait,
+                         "plugins": plugin_registry["revision"]},
+                 timeout=wait + HTTP_TIMEOUT)
+    r.raise_for_status()
+    data = r.json()
+    if data.get("resync"):
+        replication["synced"] = False
+        return
+    if data.get("plugins"):
+        apply_plugins(data["plugins"])  # before the records that may reference new ids
+    if data["mutations"] and replication["role"] == "follower":
+        apply_mutations(data["mutations"])
+    replication["last_sync"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def forward_heartbeats():
+    batch = []
+    while heartbeat_forwards and len(batch) < REPLICATION_BATCH:
+        batch.append(heartbeat_forwards.popleft())
+    if not batch or replication["role"] != "follower":
+        return
+    try:
+        http.post(replication["leader"] + "/replication/heartbeats", json=batch,
+                  headers=cluster_headers(), timeout=HTTP_TIMEOUT).raise_for_status()
+    except Exception:
+        heartbeat_forwards.extendleft(reversed(batch))  # retry on the next run
+        raise
+
+if REPLICA_OF:
+    scheduler.every("replicate", REPLICATION_POLL_TIMEOUT, follow_leader, jitter=0, delay=0,
+                    timeout=REPLICATION_POLL_TIMEOUT + HTTP_TIMEOUT * 7)
+    scheduler.every("forward-heartbeats", HEARTBEAT_FORWARD_INTERVAL, forward_heartbeats, jitter=0)
+
+@app.route("/replication/snapshot")
+def replication_snapshot():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    with licenses_lock:
+        body = json.dumps({"version": store["version"], "epoch": store["epoch"], "plugins": plugin_registry_dump(),
+                           "licenses": dict(licenses.items())})
+    return body, 200, {"Content-Type": "application/json"}
+
+@app.route("/replication/stream")
+def replication_stream():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    try:
+        since = int(request.args.get("since", 0))
+        timeout = min(float(request.args.get("timeout", REPLICATION_POLL_TIMEOUT)), REPLICATION_POLL_TIMEOUT)
+        revision = int(request.args.get("plugins", -1))
+    except: return jsonify({"error": "Invalid since/timeout"}), 400
+    if request.args.get("epoch") != store["epoch"] or since > store["version"]:
+        return jsonify({"resync": True, "version": store["version"]})  # different history (e.g. leader restarted)
+    with replication_cond:
+        replication_cond.wait_for(lambda: store["version"] > since or plugin_registry["revision"] != revision, timeout)
+        if store["version"] > since and (not replication_log or replication_log[0][0] > since + 1):
+            return jsonify({"resync": True, "version": store["version"]})
+        mutations = list(itertools.islice((m for m in replication_log if m[0] > since), REPLICATION_BATCH))
+    registry = plugin_registry_dump() if plugin_registry["revision"] != revision else None
+    return jsonify({"version": store["version"], "role": replication["role"], "mutations": mutations,
+                    "plugins": registry})
+
+@app.route("/replication/heartbeats", methods=["POST"])
+def replication_heartbeats():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    if replication["role"] != "leader": return jsonify({"error": "Not the leader"}), 409
+    applied = 0
+    with licenses_lock:
+        for key, user_id, last_check in request.get_json(silent=True) or []:
+            info = licenses.get(key)
+            if info and info.get("bound_to") == user_id and (info.get("last_check") or "") < last_check:
+                info["last_check"] = last_check
+                license_changed(key)
+                applied += 1
+            elif info and info.get("leases") and refresh_seat(key, info, user_id, last_check):
+                license_changed(key)
+                applied += 1
+        if applied:
+            save_licenses()
+    return jsonify({"success": True, "applied": applied})
+
+@app.route("/replication/status")
+def replication_status():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(dict(replication, version=store["version"], log_size=len(replication_log),
+                        pending_heartbeats=len(heartbeat_forwards)))
+
+@app.route("/replication/promote", methods=["POST"])
+def replication_promote():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    if replication["role"] == "leader":
+        return jsonify({"success": True, "message": "Already leader", "version": store["version"]})
+    with licenses_lock:
+        replication.update(role="leader", leader="", promoted_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        for key, user_id, last_check in heartbeat_forwards:
+            info = licenses.get(key)
+            if info and (info.get("bound_to") == user_id or user_id in (info.get("leases") or ())):
+                license_changed(key)
+        heartbeat_forwards.clear()
+        save_licenses()
+    scheduler.wake("expiry")
+    print(f"[REPLICA] Promoted to leader at v{store['version']}")
+    return jsonify({"success": True, "message": "Promoted to leader", "version": store["version"]})
+
+# ==========================
+# 🧩 SHARDING (consistent hashing on the license key)
+# ==========================
+# Shards (SHARD_SELF set) own the keys the ring assigns them. A router (SHARD_ROUTER=1) forwards
+# /verify and admin writes to the owner and aggregates listings/stats; clients may also route
+# themselves with /shardmap. Adding a shard pushes the new ring to every shard, which then hands
+# over keys it no longer owns in batches; until that finishes the router falls back to the
+# previous owner on invalid_key.
+class HashRing:
+    def __init__(self, shards, vnodes=SHARD_VNODES):
+        self.shards = list(shards)
+        self.vnodes = vnodes
+        self.points = sorted((ring_hash(f"{url}#{i}"), url) for url in self.shards for i in range(vnodes))
+        self.hashes = [h for h, _ in self.points]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        i = bisect.bisect(self.hashes, ring_hash(key)) % len(self.points)
+        return self.points[i][1]
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+cluster = {"ring": HashRing(SHARDS), "previous": None, "pending": [], "migrated": 0}
+
+def owns(key):
+    return not SHARD_SELF or cluster["ring"].owner(key) in (None, SHARD_SELF)
+
+def shard_request(method, base, path, **kwargs):
+    return http.request(method, base + path, headers=cluster_headers(), timeout=HTTP_TIMEOUT, **kwargs)
+
+# Parsed JSON answer of a shard, or None when it is unreachable / answers with something else
+def shard_json(method, base, path, **kwargs):
+    try:
+        r = shard_request(method, base, path, **kwargs)
+        r.raise_for_status()
+        return r.json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"[SHARD] {method} {base}{path} failed: {e}")
+        return None
+
+UNAVAILABLE = {"unavailable": True}
+
+def proxied(r):
+    return r.content, r.status_code, {"Content-Type": r.headers.get("Content-Type", "application/json")}
+
+SHARD_KEYED_ENDPOINTS = {"verify_license", "extend_license", "expire_license", "unbind_license", "delete_license", "set_seats",
+                         "lease_heartbeat"}
+
+@app.before_request
+def route_to_shard():
+    if SHARD_ROUTER and request.endpoint == "verify_batch":
+        return route_batch()
+    if not SHARD_ROUTER or (request.endpoint not in SHARD_KEYED_ENDPOINTS and request.endpoint != "generate_license"):
+        return None
+    if request.endpoint not in ("verify_license", "lease_heartbeat") and not require_login():
+        return jsonify({"error": "Unauthorized"}), 403
+    args = request.args.to_dict()
+    if request.endpoint == "generate_license":
+        custom = (args.get("key") or "").strip()
+        args["key"] = custom.upper() if len(custom) >= 6 else generate_key(args.get("plugin", "unknown"))
+    key = args.get("key") or (request.view_args or {}).get("handle", "").rsplit(".", 2)[0]
+    try:
+        r = shard_request(request.method, cluster["ring"].owner(key), request.path, params=args)
+        previous = cluster["previous"]
+        if r.status_code == 404 and previous and previous.owner(key) != cluster["ring"].owner(key):
+            r = shard_request(request.method, previous.owner(key), request.path, params=args)  # not migrated yet
+    except requests.RequestException:
+        return jsonify({"valid": False, "reason": "shard_unavailable"}), 502
+    return proxied(r)
+
+# A batch is split by owning shard; each shard answers its part and the results go back in order
+def route_batch():
+    checks = batch_checks()
+    if checks is None:
+        return jsonify({"error": f"expected {{\"checks\": [...]}} with at most {VERIFY_BATCH_MAX} entries"}), 400
+    parts = {}
+    for i, check in enumerate(checks):
+        parts.setdefault(cluster["ring"].owner(str(check.get("key") or "")), []).append(i)
+    results = [None] * len(checks)
+    for base, positions in parts.items():
+        try:
+            r = shard_request("POST", base, request.path, json={"checks": [checks[i] for i in positions]})
+            answers = r.json()["results"] if r.status_code == 200 else \
+                [dict(r.json() if r.headers.get("Content-Type", "").startswith("application/json") else {},
+                      status=r.status_code)] * len(positions)
+        except (requests.RequestException, ValueError, KeyError):
+            answers = [{"valid": False, "reason": "shard_unavailable", "status": 502}] * len(positions)
+        for i, answer in zip(positions, answers):
+            results[i] = answer
+    return jsonify({"results": results})
+
+def save_cluster():
+    with open(CLUSTER_FILE, "w") as f:
+        json.dump({"shards": cluster["ring"].shards,
+                   "previous": cluster["previous"].shards if cluster["previous"] else None}, f, indent=2)
+
+def set_ring(shards, previous=None):
+    cluster["previous"] = HashRing(previous) if previous else None
+    cluster["ring"] = HashRing(shards)
+    save_cluster()
+    if SHARD_SELF and not SHARD_ROUTER:
+        with licenses_lock:
+            cluster["pending"] = [k for k in licenses if not owns(k)]
+        if cluster["pending"]:
+            print(f"[SHARD] Ring changed, handing over {len(cluster['pending'])} keys")
+            scheduler.every("shard-migrate", 1, migrate_keys, jitter=0, delay=0)
+
+# Hands one batch of no-longer-owned keys to their new owners, then drops them locally. The imports
+# are sent without licenses_lock; a key is only dropped once its owner confirmed the very record
+# it holds now, anything else goes back to pending.
+def migrate_keys():
+    batch, cluster["pending"] = cluster["pending"][:SHARD_MIGRATION_BATCH], cluster["pending"][SHARD_MIGRATION_BATCH:]
+    by_owner = {}
+    with licenses_lock:
+        for key in batch:
+            if key in licenses and not owns(key):
+                by_owner.setdefault(cluster["ring"].owner(key), {})[key] = portable_record(licenses[key])
+    failed = None
+    for owner, records in by_owner.items():
+        try:
+            shard_request("POST", owner, "/cluster/import", json=records).raise_for_status()
+        except Exception as e:
+            cluster["pending"].extend(records)  # retried on the next run
+            failed = e
+            continue
+        with licenses_lock:
+            for key, record in records.items():
+                if key not in licenses:
+                    continue
+                if portable_record(licenses[key]) != record:
+                    cluster["pending"].append(key)  # changed while in flight: send the new version
+                    continue
+                del licenses[key]
+                license_changed(key)
+                cluster["migrated"] += 1
+            save_licenses()
+    if failed is not None:
+        raise failed
+    if not cluster["pending"]:
+        scheduler.tasks.pop("shard-migrate", None)
+        print(f"[SHARD] Migration finished ({cluster['migrated']} keys handed over)")
+
+# A ring changed through /cluster/shards survives restarts; an unfinished hand-over resumes
+if os.path.exists(CLUSTER_FILE):
+    with open(CLUSTER_FILE, "r") as f:
+        saved_ring = json.load(f)
+    if saved_ring["shards"] != cluster["ring"].shards:
+        print(f"[SHARD] Using the ring from {CLUSTER_FILE} ({len(saved_ring['shards'])} shards), not SHARDS")
+    set_ring(saved_ring["shards"], saved_ring.get("previous"))
+elif SHARDS:
+    save_cluster()
+
+@app.route("/shardmap")
+def shard_map():
+    return jsonify({
+        "shards": cluster["ring"].shards,
+        "vnodes": cluster["ring"].vnodes,
+        "hash": "blake2b-64 of '<url>#<i>' / key, owner = next point clockwise",
+        "previous": cluster["previous"].shards if cluster["previous"] else None
+    })
+
+@app.route("/cluster/ring", methods=["POST"])
+def cluster_ring():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    data = request.get_json(silent=True) or {}
+    set_ring(data.get("shards", []), data.get("previous"))
+    return jsonify({"success": True, "pending": len(cluster["pending"])})
+
+@app.route("/cluster/import", methods=["POST"])
+def cluster_import():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    records = request.get_json(silent=True) or {}
+    with licenses_lock:
+        for key, record in records.items():
+            licenses[key] = normalize_record(record)
+            license_changed(key)
+        save_licenses()
+    return jsonify({"success": True, "imported": len(records)})
 
-def generate_key():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=16))
+@app.route("/cluster/status")
+def cluster_status():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    if not SHARD_ROUTER:
+        return jsonify({"shard": SHARD_SELF, "pending": len(cluster["pending"]), "migrated": cluster["migrated"]})
+    shards = {url: shard_json("GET", url, "/cluster/status") or UNAVAILABLE for url in cluster["ring"].shards}
+    if cluster["previous"] and all(s.get("pending") == 0 for s in shards.values()):
+        cluster["previous"] = None  # every shard finished handing over
+        save_cluster()
+    return jsonify({"shards": shards, "migrating": cluster["previous"] is not None})
+
+@app.route("/cluster/shards", methods=["POST"])
+def cluster_add_shard():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    url = (request.args.get("add") or "").rstrip("/")
+    if not SHARD_ROUTER or not url: return jsonify({"error": "Router only, ?add=<shard url> required"}), 400
+    if url in cluster["ring"].shards: return jsonify({"error": "Shard already in ring"}), 400
+    previous = cluster["ring"].shards
+    set_ring(previous + [url], previous)
+    unreachable = [shard for shard in cluster["ring"].shards  # retry these with POST /cluster/ring
+                   if shard_json("POST", shard, "/cluster/ring", json={"shards": cluster["ring"].shards, "previous": previous}) is None]
+    return jsonify({"success": not unreachable, "shards": cluster["ring"].shards, "unreachable": unreachable})
+
+@app.route("/cluster/stats")
+def cluster_stats():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    shards = {url: shard_json("GET", url, "/stats") or UNAVAILABLE for url in cluster["ring"].shards}
+    totals = {}
+    for stats in shards.values():
+        for name, value in stats.items():
+            if isinstance(value, int) and not isinstance(value, bool) and name != "version":
+                totals[name] = totals.get(name, 0) + value
+    return jsonify({"totals": totals, "shards": shards, "unavailable": [u for u, s in shards.items() if s is UNAVAILABLE]})
+
+# Merges each shard's first page*per_page search hits, ordered by key
+@app.route("/cluster/licenses")
+def cluster_licenses():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    q = request.args.get("q", "")
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", SEARCH_PAGE_SIZE)), 1), 500)
+    except: return jsonify({"error": "Invalid page"}), 400
+    total, results, unavailable = 0, [], []
+    for url in cluster["ring"].shards:
+        data = shard_json("GET", url, "/search", params={"q": q, "page": 1, "per_page": page * per_page})
+        if data is None:
+            unavailable.append(url)
+            continue
+        total += data["total"]
+        results += [dict(r, shard=url) for r in data["results"]]
+    results.sort(key=lambda r: r["key"])
+    return jsonify({"query": q, "total": total, "page": page, "per_page": per_page,
+                    "results": results[(page - 1) * per_page:page * per_page], "unavailable": unavailable})
+
+# ==========================
+# 🚦 ADMISSION CONTROL (verify path)
+# ==========================
+# At most VERIFY_CONCURRENCY verifies / heartbeats run at once; the rest wait in a bounded queue
+# where refreshes of held leases go ahead of new activations. Invalid keys never queue (they cost
+# one lookup). While the smoothed queueing delay is above VERIFY_LATENCY_TARGET, activations are
+# deferred with 503 + Retry-After; a full queue evicts the newest waiting activation to make room
+# for a refresh, so refresh latency stays bounded when the box is saturated.
+ACTIVATION, REFRESH = 0, 1
+
+class AdmissionController:
+    def __init__(self, slots, queue_size, target):
+        self.slots, self.queue_size, self.target = slots, queue_size, target
+        self.cond = threading.Condition()
+        self.active = 0
+        self.queues = (deque(), deque())  # waiting tickets ([state]) by priority
+        self.delay = 0.0  # EWMA of the queueing delay of admitted requests
+        self.shed = [0, 0]
+
+    # True once a slot is held (call release() afterwards); False = shed
+    def acquire(self, priority):
+        with self.cond:
+            if self.active < self.slots and not (self.queues[ACTIVATION] or self.queues[REFRESH]):
+                self.active += 1
+                self.delay *= 0.9
+                return True
+            if priority == ACTIVATION and self.delay > self.target:
+                return self.reject(priority)
+            if len(self.queues[ACTIVATION]) + len(self.queues[REFRESH]) >= self.queue_size:
+                if priority == ACTIVATION or not self.queues[ACTIVATION]:
+                    return self.reject(priority)
+                self.queues[ACTIVATION].pop()[0] = "shed"  # newest activation makes room
+                self.shed[ACTIVATION] += 1
+            ticket, queue = ["waiting"], self.queues[priority]
+            queue.append(ticket)
+            started = time.monotonic()
+            deadline = started + (self.target if priority == ACTIVATION else REFRESH_MAX_WAIT)
+            while ticket[0] == "waiting":
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.remove(ticket)
+                    return self.reject(priority)
+                self.cond.wait(remaining)
+            if ticket[0] == "shed":
+                return False
+            self.delay = self.delay * 0.9 + (time.monotonic() - started) * 0.1
+            return True
+
+    def reject(self, priority):
+        self.shed[priority] += 1
+        return False
+
+    def release(self):
+        with self.cond:
+            for queue in (self.queues[REFRESH], self.queues[ACTIVATION]):
+                if queue:
+                    queue.popleft()[0] = "granted"  # the slot passes straight to the waiter
+                    self.cond.notify_all()
+                    return
+            self.active -= 1
+
+admission = AdmissionController(VERIFY_CONCURRENCY, VERIFY_QUEUE_SIZE, VERIFY_LATENCY_TARGET)
+
+def verify_priority(key, user_id):
+    info = licenses.get(key) if key and isinstance(key, str) and maybe_issued(key, count=False) else None
+    if info is None:
+        return None  # answered straight away without a slot
+    return REFRESH if user_id and (info.get("bound_to") == user_id or user_id in (info.get("leases") or ())) else ACTIVATION
+
+# A batch takes one slot; it queues as a refresh only if every check in it refreshes a held lease
+@app.before_request
+def admit_verify():
+    if request.endpoint == "lease_heartbeat":
+        key = request.view_args["handle"].rsplit(".", 2)[0]
+        priority = REFRESH if maybe_issued(key, count=False) and key in licenses else None  # unknown handles: answered without a slot
+    elif request.endpoint == "verify_license":
+        priority = verify_priority(request.args.get("key"), request.args.get("user_id"))
+    elif request.endpoint == "verify_batch":
+        priorities = {verify_priority(c.get("key"), c.get("user_id")) for c in batch_checks() or ()} - {None}
+        priority = min(priorities) if priorities else None
+    else:
+        return None
+    if priority is None:
+        return None
+    if admission.acquire(priority):
+        g.admitted = True
+        return None
+    g.verify_outcome = "shed"
+    wait = SHED_RETRY_AFTER + random.randint(0, SHED_RETRY_AFTER) if priority == ACTIVATION else 1
+    body = jsonify({"valid": False, "reason": "overloaded", "retry_after": wait}) \
+        if request.endpoint != "lease_heartbeat" else ""
+    return body, 503, {"Retry-After": str(wait)}
+
+@app.teardown_request
+def release_verify_slot(exc):
+    if g.pop("admitted", False):
+        admission.release()
 
 # ==========================
 # 🔍 VERIFY LICENSE (with plugin binding)
 # ==========================
 @app.route("/verify", methods=["GET"])
 def verify_license():
-    key = request.args.get("key")
-    user_id = request.args.get("user_id")
-    plugin_name = request.args.get("plugin", "").strip()
+    with phase("parse"):
+        key = request.args.get("key")
+        user_id = request.args.get("user_id")
+        plugin_name = request.args.get("plugin", "").strip()
+    outcome, body, code = coalesced((key, user_id, plugin_name), check_license)
+    g.verify_outcome = outcome
+    if code == 307:
+        return redirect(replication["leader"] + request.full_path, 307)
+    if code == 429:
+        return jsonify(body), code, {"Retry-After": str(body["retry_after"])}
+    with phase("jsonify"):
+        return jsonify(body), code
+
+# POST {"checks": [{"key", "user_id", "plugin"}, ...]} -> {"results": [body + "status", ...]} in the
+# same order. Lets one host process refresh all of its plugins' licenses in a single round trip;
+# each check goes through the same single-flight evaluation as /verify.
+def batch_checks():
+    payload = request.get_json(silent=True)
+    checks = payload.get("checks") if isinstance(payload, dict) else None
+    if not isinstance(checks, list) or len(checks) > VERIFY_BATCH_MAX or not all(isinstance(c, dict) for c in checks):
+        return None
+    return checks
+
+@app.route("/verify/batch", methods=["POST"])
+def verify_batch():
+    checks = batch_checks()
+    if checks is None:
+        return jsonify({"error": f"expected {{\"checks\": [...]}} with at most {VERIFY_BATCH_MAX} entries"}), 400
+    results = []
+    for check in checks:
+        key, user_id = check.get("key"), check.get("user_id")
+        plugin_name = str(check.get("plugin") or "").strip()
+        if not isinstance(key, str) or not isinstance(user_id, (str, type(None))):
+            results.append({"valid": False, "reason": "invalid_key", "status": 404})
+            if CAPTURE:
+                g.setdefault("batch_results", []).append((check, "invalid_key", 404, None))
+            continue
+        outcome, body, code = coalesced((key, user_id, plugin_name), check_license)
+        if code == 307:
+            g.verify_outcome = "forwarded"
+            return redirect(replication["leader"] + request.full_path, 307)  # claims are decided by the leader
+        results.append(dict(body, status=code))
+        if CAPTURE:
+            g.setdefault("batch_results", []).append((check, outcome, code, body.get("seats")))
+    g.verify_outcome = "batch"
+    return jsonify({"results": results})
 
-    if not key or key not in licenses:
-        return jsonify({"valid": False, "reason": "invalid_key"}), 404
+# ==========================
+# 🪢 SINGLE-FLIGHT VERIFY
+# ==========================
+# Identical (key, user_id, plugin) verifies arriving while one is being evaluated wait for and
+# share its result: one evaluation, one persistence step. Different user_ids on the same key are
+# serialized on a lock stripe so two hosts can never both claim a free license.
+inflight = {}  # (key, user_id, plugin) -> [done Event, result]
+inflight_lock = threading.Lock()
+key_locks = [threading.Lock() for _ in range(KEY_LOCK_STRIPES)]
+verify_stats = {"coalesced": 0, "writes_suppressed": 0, "filtered": 0}
+
+def count_verify(name):
+    with metrics_lock:
+        verify_stats[name] += 1
+
+def coalesced(flight, evaluate):
+    with inflight_lock:
+        call = inflight.get(flight)
+        leader = call is None
+        if leader:
+            call = inflight[flight] = [threading.Event(), None]
+    if not leader:
+        call[0].wait()
+        if call[1] is not None:
+            count_verify("coalesced")
+            return call[1]
+        with key_locks[hash(flight[0]) % KEY_LOCK_STRIPES]:
+            return evaluate(*flight)  # the leader failed; evaluate on our own (still serialized per key)
+    try:
+        with key_locks[hash(flight[0]) % KEY_LOCK_STRIPES]:
+            call[1] = evaluate(*flight)
+        return call[1]
+    finally:
+        with inflight_lock:
+            del inflight[flight]
+        call[0].set()
+
+# Returns (outcome, response body, status code); outcome labels the verify metrics
+def check_license(key, user_id, plugin_name):
+    known = bool(key) and maybe_issued(key)
+    if not known or key not in licenses:
+        if key and not owns(key):
+            return "wrong_shard", {"valid": False, "reason": "wrong_shard", "owner": cluster["ring"].owner(key)}, 421
+        early = verify_archived(key) if known and archive else None
+        if early is not None:
+            return early
+        if not known or key not in licenses:
+            return "invalid_key", {"valid": False, "reason": "invalid_key"}, 404
 
     info = licenses[key]
-    now = datetime.now()
+    now = clock.now()
 
-    # ✅ Case-insensitive plugin name check
-    stored_plugin = (info.get("plugin") or "").strip().lower()
-    incoming_plugin = (plugin_name or "").strip().lower()
+    # ✅ Case-insensitive plugin check (registry ids; the name is only normalized on a cache miss)
+    plugin = plugin_of(info)
+    stored_plugin = plugin.canonical if plugin else ""
 
-    if not incoming_plugin:
-        return jsonify({
+    if not plugin_name:
+        return "missing_plugin_name", {
             "valid": False,
             "reason": "missing_plugin_name",
             "expected_plugin": stored_plugin
-        }), 403
+        }, 403
 
-    if stored_plugin and stored_plugin != incoming_plugin:
-        return jsonify({
+    if (plugin and plugin.id != incoming_plugin_id(plugin_name)) or (plugin is None and plugin_unknown(info)):
+        return "wrong_plugin", {
             "valid": False,
             "reason": "wrong_plugin",
             "expected_plugin": stored_plugin
-        }), 403
+        }, 403
+
+    if plugin and plugin.rate_limit:
+        wait = rate_limited(key, plugin.rate_limit)
+        if wait:
+            return "rate_limited", {"valid": False, "reason": "rate_limited", "retry_after": wait}, 429
 
-    expires = datetime.strptime(info["expires"], "%Y-%m-%d")
+    with phase("strptime"):
+        expires = datetime.strptime(info["expires"], "%Y-%m-%d")
     if now > expires:
-        return jsonify({"valid": False, "reason": "expired", "user": info["user"]})
+        return "expired", {"valid": False, "reason": "expired", "user": info["user"]}, 200
+
+    if info.get("seats", 1) > 1:
+        return check_seat(key, info, user_id, plugin_name, now)
 
     bound_to = info.get("bound_to")
     last_check = info.get("last_check")
@@ -74,27 +2083,251 @@ def verify_license():
 
     # ⏱ Free license if heartbeat expired
     if bound_to and last_check:
-        last_dt = datetime.strptime(last_check, "%Y-%m-%d %H:%M:%S")
-        if (now - last_dt).total_seconds() > HEARTBEAT_TIMEOUT:
+        with phase("strptime"):
+            last_dt = datetime.strptime(last_check, "%Y-%m-%d %H:%M:%S")
+        if (now - last_dt).total_seconds() > heartbeat_timeout(info):
+            if replication["role"] == "follower":
+                return "forwarded", None, 307
+            audit("lost", key, bound_to, last_check=last_check)
             info["in_use"] = False
             info["bound_to"] = None
             info["last_check"] = None
-            save_licenses()
+            info["last_seen"] = last_check[:10]
+            save_licenses(); license_changed(key)
 
     # 🟢 Claim or refresh license
     if not info.get("in_use") or not info.get("bound_to"):
+        if replication["role"] == "follower":
+            return "forwarded", None, 307  # claims are decided by the leader
         info["bound_to"] = user_id
         info["in_use"] = True
         info["last_check"] = now.strftime("%Y-%m-%d %H:%M:%S")
-        save_licenses()
-        return jsonify({"valid": True, "note": "License activated", "plugin": plugin_name})
+        save_licenses(); license_changed(key)
+        audit("claimed", key, user_id)
+        return "activated", {"valid": True, "note": "License activated", "plugin": plugin_name,
+                             "lease": lease_handle(key, 0, user_id)}, 200
 
     if bound_to == user_id:
-        info["last_check"] = now.strftime("%Y-%m-%d %H:%M:%S")
-        save_licenses()
-        return jsonify({"valid": True, "note": "Heartbeat refreshed", "plugin": plugin_name})
+        if last_check and (now - last_dt).total_seconds() < REFRESH_WRITE_WINDOW:
+            count_verify("writes_suppressed")  # still well inside the heartbeat timeout
+        else:
+            info["last_check"] = now.strftime("%Y-%m-%d %H:%M:%S")
+            if replication["role"] == "follower":
+                heartbeat_forwards.append((key, user_id, info["last_check"]))  # leader persists it
+            else:
+                save_licenses(); license_changed(key)
+            audit("refreshed", key, user_id)
+        return "refreshed", {"valid": True, "note": "Heartbeat refreshed", "plugin": plugin_name,
+                             "lease": lease_handle(key, 0, user_id)}, 200
+
+    return "license_in_use", {"valid": False, "reason": "license_in_use", "bound_to": bound_to}, 200
+
+# Token bucket per license key (burst = one minute's allowance); returns seconds to wait, 0 if allowed.
+# Runs under the key's lock stripe, so buckets need no lock of their own.
+rate_buckets = {}  # key -> [tokens, clock.time() of last update] (wall / virtual seconds, so simulations refill too)
+
+def rate_limited(key, per_minute):
+    now = clock.time()
+    bucket = rate_buckets.get(key)
+    if bucket is None:
+        bucket = rate_buckets[key] = [per_minute, now]
+    bucket[0] = min(bucket[0] + (now - bucket[1]) * per_minute / 60, per_minute)
+    bucket[1] = now
+    if bucket[0] >= 1:
+        bucket[0] -= 1
+        return 0
+    return max(int((1 - bucket[0]) * 60 / per_minute + 0.999), 1)
+
+# ==========================
+# 🪑 MULTI-SEAT LICENSES
+# ==========================
+# A license with "seats": N > 1 keeps one lease per user_id in "leases" ({user_id: [seat, last_check]}),
+# persisted with the record. Each such key gets an in-memory SeatPool: a stack of free seat numbers
+# (O(1) allocate/release) and the holders ordered by last refresh, so timed-out leases are always at
+# the front and reclaiming them costs O(1) per lease. Single-seat licenses keep bound_to as before.
+class SeatPool:
+    __slots__ = ("leases", "seats", "free", "holders", "by_seat")
+
+    def __init__(self, leases, seats):
+        self.leases = leases  # the record's lease dict this pool mirrors (rebuilt if it is replaced)
+        self.seats = seats
+        self.holders = OrderedDict((u, lease[0]) for u, lease in sorted(leases.items(), key=lambda kv: kv[1][1]))
+        self.by_seat = {seat: u for u, seat in self.holders.items()}
+        self.free = [s for s in range(seats - 1, -1, -1) if s not in self.by_seat]  # lowest seat on top
+
+    def allocate(self, user_id, stamp):
+        seat = self.free.pop()
+        self.leases[user_id] = [seat, stamp]
+        self.holders[user_id] = seat
+        self.by_seat[seat] = user_id
+        return seat
+
+    def release(self, user_id):
+        seat = self.holders.pop(user_id)
+        del self.leases[user_id]
+        del self.by_seat[seat]
+        if seat < self.seats:
+            self.free.append(seat)
+        return seat
+
+seat_pools = {}  # key -> SeatPool, built on first use
+
+def seat_pool(key, info):
+    leases = info.setdefault("leases", {})
+    pool = seat_pools.get(key)
+    if pool is None or pool.leases is not leases or pool.seats != info["seats"]:
+        pool = seat_pools[key] = SeatPool(leases, info["seats"])
+    return pool
+
+# Applies a (possibly forwarded) refresh of a held seat; False if the lease is gone or newer
+def refresh_seat(key, info, user_id, stamp):
+    lease = (info.get("leases") or {}).get(user_id)
+    if lease is None or lease[1] >= stamp:
+        return False
+    info["leases"][user_id] = [lease[0], stamp]
+    info["last_check"] = max(info.get("last_check") or "", stamp)
+    pool = seat_pool(key, info)
+    if user_id in pool.holders:
+        pool.holders.move_to_end(user_id)
+    return True
+
+def check_seat(key, info, user_id, plugin_name, now):
+    pool = seat_pool(key, info)
+    stamp = now.strftime("%Y-%m-%d %H:%M:%S")
+    cutoff = (now - timedelta(seconds=heartbeat_timeout(info))).strftime("%Y-%m-%d %H:%M:%S")
+    lease = pool.leases.get(user_id)
+
+    if lease and lease[1] >= cutoff:
+        seat = lease[0]
+        if (now - datetime.strptime(lease[1], "%Y-%m-%d %H:%M:%S")).total_seconds() < REFRESH_WRITE_WINDOW:
+            count_verify("writes_suppressed")
+        elif replication["role"] == "follower":
+            refresh_seat(key, info, user_id, stamp)
+            heartbeat_forwards.append((key, user_id, stamp))  # leader persists it
+        else:
+            refresh_seat(key, info, user_id, stamp)
+            save_licenses(); license_changed(key)
+            audit("refreshed", key, user_id, seat=seat)
+        return "refreshed", {"valid": True, "note": "Heartbeat refreshed", "plugin": plugin_name, "seat": seat,
+                             "lease": lease_handle(key, seat, user_id)}, 200
+
+    if replication["role"] == "follower":
+        return "forwarded", None, 307  # claims and reclaims are decided by the leader
+
+    # ⏱ Reclaim timed-out seats (least recently refreshed first)
+    reclaimed = False
+    while pool.holders:
+        holder = next(iter(pool.holders))
+        last = pool.leases[holder][1]
+        if last >= cutoff:
+            break
+        audit("lost", key, holder, seat=pool.release(holder), last_check=last)
+        reclaimed = True
+
+    if not pool.free:
+        if reclaimed:
+            save_licenses(); license_changed(key)
+        return "license_in_use", {"valid": False, "reason": "seats_full", "seats": info["seats"],
+                                  "in_use": len(pool.holders)}, 200
+
+    seat = pool.allocate(user_id, stamp)
+    info["in_use"] = True
+    info["last_check"] = stamp
+    save_licenses(); license_changed(key)
+    audit("claimed", key, user_id, seat=seat)
+    return "activated", {"valid": True, "note": "License activated", "plugin": plugin_name, "seat": seat,
+                         "seats": info["seats"], "lease": lease_handle(key, seat, user_id)}, 200
+
+# ==========================
+# 💓 LEASE HEARTBEATS
+# ==========================
+# Activation hands out a lease handle "<key>.<seat>.<mac>", the mac being an HMAC of (key, seat, user_id).
+# Handles are stateless: any node with LEASE_SECRET checks one against the current holder of that seat,
+# and the router can shard on the key. A heartbeat only refreshes the lease: no plugin / expiry parsing,
+# no JSON, and the answer is a bare status code (HTTP) or a single byte (UDP). Anything other than
+# "ok" means the client should fall back to a full /verify.
+heartbeat_stats = {"ok": 0, "gone": 0, "unknown": 0, "wrong_shard": 0}
+HEARTBEAT_STATUS = {"ok": 204, "gone": 410, "unknown": 404, "wrong_shard": 421}
+HEARTBEAT_REPLY = {"ok": b"\x00", "gone": b"\x01", "unknown": b"\x02", "wrong_shard": b"\x03"}
+
+def lease_mac(key, seat, user_id):
+    digest = hmac.new(LEASE_SECRET, f"{key}:{seat}:{user_id}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:12]).decode()
+
+def lease_handle(key, seat, user_id):
+    return f"{key}.{seat}.{lease_mac(key, seat, user_id)}"
+
+def refresh_lease(handle):
+    try:
+        key, seat, mac = handle.rsplit(".", 2)
+        seat = int(seat)
+    except ValueError:
+        return "unknown"
+    info = licenses.get(key) if maybe_issued(key) else None
+    if info is None:
+        return "unknown" if owns(key) else "wrong_shard"
+    now = clock.now()
+    stamp = now.strftime("%Y-%m-%d %H:%M:%S")
+    with key_locks[hash(key) % KEY_LOCK_STRIPES]:
+        if info.get("seats", 1) > 1:
+            user_id = seat_pool(key, info).by_seat.get(seat)
+            last = info["leases"][user_id][1] if user_id is not None else None
+        else:
+            user_id = info.get("bound_to") if seat == 0 else None
+            last = info.get("last_check")
+        if user_id is None or not last or not hmac.compare_digest(mac, lease_mac(key, seat, user_id)):
+            return "gone"  # released, reclaimed or handed to someone else
+        if info.get("expired") or info["expires"] <= stamp[:10] \
+                or last < (now - timedelta(seconds=heartbeat_timeout(info))).strftime("%Y-%m-%d %H:%M:%S"):
+            return "gone"
+        if last > (now - timedelta(seconds=REFRESH_WRITE_WINDOW)).strftime("%Y-%m-%d %H:%M:%S"):
+            count_verify("writes_suppressed")
+            return "ok"
+        if "leases" in info:
+            refresh_seat(key, info, user_id, stamp)
+        else:
+            info["last_check"] = stamp
+        if replication["role"] == "follower":
+            heartbeat_forwards.append((key, user_id, stamp))  # leader persists it
+        else:
+            save_licenses(); license_changed(key)
+    audit("refreshed", key, user_id, seat=seat)
+    return "ok"
+
+@app.route("/hb/<handle>", methods=["GET", "POST"])
+def lease_heartbeat(handle):
+    result = refresh_lease(handle)
+    heartbeat_stats[result] += 1
+    g.verify_outcome = "lease_" + result
+    return "", HEARTBEAT_STATUS[result]
+
+# Datagram = the handle (ASCII), reply = one status byte. Runs as a scheduler task that serves
+# until just before its next run, like the replication long-poll.
+udp_heartbeats = {"sock": None}
+
+def serve_udp_heartbeats():
+    sock = udp_heartbeats["sock"]
+    if sock is None:
+        sock = udp_heartbeats["sock"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("0.0.0.0", HEARTBEAT_UDP_PORT))
+        sock.settimeout(1)
+        print(f"[HEARTBEAT] UDP listener on port {HEARTBEAT_UDP_PORT}")
+    deadline = time.monotonic() + 29
+    while time.monotonic() < deadline and not scheduler.stopping:
+        try:
+            data, addr = sock.recvfrom(512)
+        except socket.timeout:
+            continue
+        try:
+            result = refresh_lease(data.decode("ascii").strip())
+        except Exception as e:
+            print("[HEARTBEAT] UDP refresh failed:", e)
+            continue
+        heartbeat_stats[result] += 1
+        sock.sendto(HEARTBEAT_REPLY[result], addr)
 
-    return jsonify({"valid": False, "reason": "license_in_use", "bound_to": bound_to})
+if HEARTBEAT_UDP_PORT:
+    scheduler.every("udp-heartbeats", 30, serve_udp_heartbeats, jitter=0, delay=0, timeout=35)
 
 # ==========================
 # 🧠 LOGIN SYSTEM
@@ -116,50 +2349,79 @@ def logout():
     return redirect("/login")
 
 def require_login():
-    return session.get("logged_in", False)
+    return session.get("logged_in", False) or cluster_token_ok()
 
 # ==========================
 # 🧾 LICENSE MANAGEMENT
 # ==========================
+# Conditional GET: read-only admin payloads carry a weak ETag built from the store's mutation
+# version (plus anything else the payload depends on, e.g. the date). A matching If-None-Match
+# gets 304 before anything is rendered or serialized.
+def store_tag(*extra):
+    return "-".join(map(str, (store["epoch"], store["version"], plugin_registry["revision"]) + extra))
+
+def unchanged(tag):
+    return request.if_none_match.contains_weak(tag)
+
+def tagged(rv, tag):
+    response = app.make_response(rv)
+    response.set_etag(tag, weak=True)
+    response.headers["X-Store-Version"] = str(store["version"])
+    return response
+
 @app.route("/generate", methods=["POST", "GET"])
 def generate_license():
     if not require_login():
         return jsonify({"error": "Unauthorized"}), 403
 
-    user = request.args.get("user", "unknown")
-    days = request.args.get("days", DEFAULT_EXPIRY_DAYS)
+    user = sys.intern(request.args.get("user", "unknown"))
     plugin_name = request.args.get("plugin", "unknown").strip()
+    plugin = register_plugin(plugin_name)
+    default_days = plugin.default_expiry_days if plugin and plugin.default_expiry_days else DEFAULT_EXPIRY_DAYS
+    days = request.args.get("days", default_days)
     custom_key = request.args.get("key")
 
     try:
         days = int(days)
     except:
-        days = DEFAULT_EXPIRY_DAYS
+        days = default_days
+    try: seats = min(max(int(request.args.get("seats", 1)), 1), MAX_SEATS)
+    except: return jsonify({"success": False, "error": "Invalid seats"}), 400
 
     if custom_key and len(custom_key.strip()) >= 6:
         key = custom_key.strip().upper()
         if key in licenses:
             return jsonify({"success": False, "error": "Key already exists"}), 400
+        if not key_format_ok(key):
+            return jsonify({"success": False, "error": f"Custom keys starting with {KEY_PREFIX} must carry a valid checksum"}), 400
     else:
-        key = generate_key()
-
-    expires = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d")
-
-    licenses[key] = {
-        "user": user,
-        "plugin": plugin_name,
-        "expires": expires,
-        "in_use": False,
-        "bound_to": None,
-        "last_check": None
-    }
-    save_licenses()
+        key = generate_key(plugin_name)
+
+    expires = (clock.now() + timedelta(days=days)).strftime("%Y-%m-%d")
+
+    with licenses_lock:
+        licenses[key] = {
+            "user": user,
+            "plugin": plugin.canonical if plugin else "",
+            "plugin_id": plugin.id if plugin else None,
+            "expires": expires,
+            "in_use": False,
+            "bound_to": None,
+            "last_check": None,
+            "created": day_str(clock.now())
+        }
+        if seats > 1:
+            licenses[key].update(seats=seats, leases={})
+        save_licenses()
+        license_changed(key)
+    audit("generated", key, user=user, plugin=plugin_name, expires=expires, seats=seats)
     return jsonify({
         "success": True,
         "key": key,
         "user": user,
         "plugin": plugin_name,
-        "expires": expires
+        "expires": expires,
+        "seats": seats
     })
 
 @app.route("/extend", methods=["POST"])
@@ -170,7 +2432,10 @@ def extend_license():
     try: days = int(days)
     except: return jsonify({"error": "Invalid days"}), 400
     exp = datetime.strptime(licenses[key]["expires"], "%Y-%m-%d") + timedelta(days=days)
-    licenses[key]["expires"] = exp.strftime("%Y-%m-%d"); save_licenses()
+    licenses[key]["expires"] = exp.strftime("%Y-%m-%d")
+    if exp > clock.now(): licenses[key].pop("expired", None)
+    save_licenses(); license_changed(key)
+    audit("extended", key, expires=licenses[key]["expires"])
     return jsonify({"success": True, "message": f"Extended to {licenses[key]['expires']}"})
 
 @app.route("/expire", methods=["POST"])
@@ -178,34 +2443,208 @@ def expire_license():
     if not require_login(): return jsonify({"error": "Unauthorized"}), 403
     key = request.args.get("key")
     if key not in licenses: return jsonify({"error": "Not found"}), 404
-    licenses[key]["expires"] = datetime.now().strftime("%Y-%m-%d"); save_licenses()
+    licenses[key]["expires"] = clock.now().strftime("%Y-%m-%d"); save_licenses(); license_changed(key)
+    audit("expired_now", key)
     return jsonify({"success": True, "message": "Expired now"})
 
 @app.route("/unbind", methods=["POST"])
 def unbind_license():
     if not require_login(): return jsonify({"error": "Unauthorized"}), 403
-    key = request.args.get("key")
+    key = request.args.get("key"); user_id = request.args.get("user_id")
     if key not in licenses: return jsonify({"error": "Not found"}), 404
-    licenses[key]["bound_to"] = None; licenses[key]["in_use"] = False; licenses[key]["last_check"] = None
-    save_licenses()
+    info = licenses[key]
+    if info.get("leases") and user_id:  # free a single seat
+        with key_locks[hash(key) % KEY_LOCK_STRIPES]:
+            pool = seat_pool(key, info)
+            if user_id not in pool.holders: return jsonify({"error": "No seat held by that user_id"}), 404
+            audit("unbound", key, user_id, seat=pool.release(user_id))
+            info["in_use"] = bool(info["leases"])
+            save_licenses(); license_changed(key)
+        return jsonify({"success": True, "message": f"Released seat of {user_id}"})
+    audit("unbound", key, info.get("bound_to"))
+    for holder in info.get("leases") or ():
+        audit("unbound", key, holder)
+    if "leases" in info: info["leases"] = {}
+    if info.get("last_check"): info["last_seen"] = info["last_check"][:10]
+    info["bound_to"] = None; info["in_use"] = False; info["last_check"] = None
+    save_licenses(); license_changed(key)
     return jsonify({"success": True, "message": "Unbound successfully"})
 
+@app.route("/seats", methods=["POST"])
+def set_seats():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    key = request.args.get("key")
+    if key not in licenses: return jsonify({"error": "Not found"}), 404
+    try: seats = min(max(int(request.args.get("seats")), 1), MAX_SEATS)
+    except: return jsonify({"error": "Invalid seats"}), 400
+    info = licenses[key]
+    if seats == 1 and info.get("leases"):
+        return jsonify({"error": "Release the held seats before going back to a single seat"}), 409
+    with key_locks[hash(key) % KEY_LOCK_STRIPES]:
+        if seats > 1:
+            if info.get("bound_to") and "leases" not in info:  # the current binding keeps seat 0
+                info["leases"] = {info["bound_to"]: [0, info.get("last_check") or ""]}
+                info["bound_to"] = None
+            info["seats"] = seats
+            info.setdefault("leases", {})
+        else:
+            info.pop("seats", None); info.pop("leases", None)
+        seat_pools.pop(key, None)
+        save_licenses(); license_changed(key)
+    audit("seats", key, seats=seats)
+    return jsonify({"success": True, "message": f"Seats set to {seats}"})
+
 @app.route("/delete", methods=["POST"])
 def delete_license():
     if not require_login(): return jsonify({"error": "Unauthorized"}), 403
     key = request.args.get("key")
     if key not in licenses: return jsonify({"error": "Not found"}), 404
-    del licenses[key]; save_licenses()
+    with licenses_lock:
+        del licenses[key]; save_licenses(); license_changed(key)
+    audit("deleted", key)
     return jsonify({"success": True, "message": f"Deleted {key}"})
 
 @app.route("/backup")
 def backup():
     if not require_login(): return jsonify({"error": "Unauthorized"}), 403
-    with open(DATA_FILE, "rb") as f:
-        return f.read(), 200, {
-            "Content-Type": "application/json",
-            "Content-Disposition": "attachment; filename=licenses_backup.json"
-        }
+    tag = store_tag()
+    if unchanged(tag): return tagged(("", 304), tag)
+    with licenses_lock:  # plugins by name, so the backup does not depend on plugins.json
+        body = json.dumps({k: portable_record(v) for k, v in licenses.items()}, indent=2)
+    return tagged((body, 200, {
+        "Content-Type": "application/json",
+        "Content-Disposition": "attachment; filename=licenses_backup.json"
+    }), tag)
+
+# Delta for pollers: the latest state of every key changed after ?since=<version> (record null =
+# deleted). resync=true means the history no longer reaches back that far: refetch /backup.
+@app.route("/changes")
+def changes():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    try: since = int(request.args.get("since", 0))
+    except: return jsonify({"error": "Invalid since"}), 400
+    epoch = request.args.get("epoch", store["epoch"])
+    with replication_cond:
+        version = store["version"]
+        if epoch != store["epoch"] or since > version or (since < version and (not replication_log or replication_log[0][0] > since + 1)):
+            return jsonify({"resync": True, "version": version, "epoch": store["epoch"]})
+        latest = {key: record for v, key, record in replication_log if v > since}
+    return jsonify({
+        "version": version,
+        "epoch": store["epoch"],
+        "changes": {key: portable_record(record) if record and "archived" not in record else record
+                    for key, record in latest.items()}
+    })
+
+@app.route("/archive")
+def archive_search():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    if not archive: return jsonify({"error": "Archive disabled (ARCHIVE_AFTER_DAYS=0)"}), 404
+    q = request.args.get("q", "").strip()
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", SEARCH_PAGE_SIZE)), 1), 500)
+    except: return jsonify({"error": "Invalid page"}), 400
+    total, results = archive.search(q, per_page, (page - 1) * per_page)
+    return jsonify({"query": q, "total": total, "page": page, "per_page": per_page, "results": results})
+
+@app.route("/archive/restore", methods=["POST"])
+def archive_restore():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    key = request.args.get("key")
+    entry = archive.get(key) if archive and key else None
+    if entry is None: return jsonify({"error": "Not archived"}), 404
+    restore_license(key, entry, "admin")
+    return jsonify({"success": True, "message": f"Restored {key}", "reason": entry["reason"]})
+
+@app.route("/archive/run", methods=["POST"])
+def archive_run():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    if not archive: return jsonify({"error": "Archive disabled (ARCHIVE_AFTER_DAYS=0)"}), 404
+    scheduler.wake("archive")
+    return jsonify({"success": True, "message": "Archival sweep scheduled"})
+
+@app.route("/plugins", methods=["GET"])
+def list_plugins():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(plugin_registry_dump())
+
+# Registers a plugin or updates its policy: /plugins?name=X&heartbeat_timeout=&default_expiry_days=&rate_limit=
+# (an empty value resets that policy to the global default)
+@app.route("/plugins", methods=["POST"])
+def update_plugin():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    if SHARD_ROUTER:  # every shard keeps its own registry
+        results = [shard_request("POST", url, "/plugins", params=request.args.to_dict()).json()
+                   for url in cluster["ring"].shards]
+        return jsonify({"success": all(r.get("success") for r in results), "shards": results})
+    try:
+        policy = {p: int(request.args[p]) if request.args[p] else None for p in Plugin.POLICY if p in request.args}
+    except ValueError: return jsonify({"error": "Policy values must be integers"}), 400
+    plugin = register_plugin(request.args.get("name", ""))
+    if plugin is None: return jsonify({"error": "name required"}), 400
+    with plugins_lock:
+        for name, value in policy.items():
+            setattr(plugin, name, value)
+        plugin_registry["revision"] += 1
+        save_plugins()
+    with replication_cond:
+        replication_cond.notify_all()  # followers pick up the new policy right away
+    audit("plugin_policy", None, plugin=plugin.name, **policy)
+    return jsonify({"success": True, "plugin": plugin.as_dict()})
+
+@app.route("/search")
+def search():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    q = request.args.get("q", "")
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", SEARCH_PAGE_SIZE)), 1), 500)
+    except: return jsonify({"error": "Invalid page"}), 400
+    tag = store_tag()
+    if unchanged(tag): return tagged(("", 304), tag)
+    keys = search_licenses(q)
+    results = [dict(portable_record(licenses[k]), key=k) for k in keys[(page - 1) * per_page:page * per_page] if k in licenses]
+    return tagged(jsonify({"query": q, "total": len(keys), "page": page, "per_page": per_page, "results": results}), tag)
+
+@app.route("/stats")
+def stats():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    now = clock.now()
+    tag = store_tag(day_str(now), replication["role"])  # expiry counts move with the date
+    if unchanged(tag): return tagged(("", 304), tag)
+    tomorrow = day_str(now + timedelta(days=1))
+    return tagged(jsonify({
+        "licenses": len(licenses),
+        "archived": archive.count() if archive else 0,
+        "bound": len(bound_keys),
+        "seat_leases": sum(seat_counts.values()),
+        "expired": len(expiring_between("", tomorrow)),
+        "expiring_soon": len(expiring_between(tomorrow, day_str(now + timedelta(days=EXPIRY_WARNING_DAYS + 2)))),
+        "version": store["version"],
+        "role": replication["role"]
+    }), tag)
+
+@app.route("/expiring")
+def expiring_licenses():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    try: days = int(request.args.get("days", EXPIRY_WARNING_DAYS))
+    except: return jsonify({"error": "Invalid days"}), 400
+    today = clock.now()
+    tag = store_tag(day_str(today))
+    if unchanged(tag): return tagged(("", 304), tag)
+    keys = expiring_between(day_str(today), day_str(today + timedelta(days=days + 1)))
+    return tagged(jsonify({
+        "days": days,
+        "count": len(keys),
+        "licenses": [{"key": k, "user": licenses[k]["user"], "expires": licenses[k]["expires"]} for k in keys]
+    }), tag)
+
+@app.route("/expiry_events")
+def expiry_event_log():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    kind = request.args.get("event")
+    return jsonify([e for e in expiry_events if not kind or e["event"] == kind])
 
 # ==========================
 # 🌐 DASHBOARD
@@ -214,6 +2653,8 @@ def backup():
 def admin_dashboard():
     if not require_login():
         return redirect("/login")
+    tag = store_tag(int(clock.time()) // 5)  # the heartbeat status column changes with time alone
+    if unchanged(tag): return tagged(("", 304), tag)
 
     html = """<!DOCTYPE html><html><head>
     <title>License Dashboard</title>
@@ -239,8 +2680,7 @@ def admin_dashboard():
     <script>
       async function action(t,k){const r=await fetch(`/${t}?key=${k}`,{method:"POST"});const j=await r.json();alert(j.message||JSON.stringify(j));location.reload();}
       async function extendLicense(k){const d=prompt("Days to extend:");if(!d)return;const r=await fetch(`/extend?key=${k}&days=${d}`,{method:"POST"});const j=await r.json();alert(j.message||JSON.stringify(j));location.reload();}
-      async function createLicense(e){e.preventDefault();const u=document.getElementById("username").value;const d=document.getElementById("days").value;const c=document.getElementById("customKey").value;const p=document.getElementById("pluginName").value;let url=`/generate?user=${u}&days=${d}&plugin=${p}`;if(c)url+=`&key=${encodeURIComponent(c)}`;const r=await fetch(url,{method:"POST"});const j=await r.json();alert(j.success?"✅ Created: "+j.key:"❌ "+j.error);location.reload();}
-      function search(){const f=document.getElementById("searchBox").value.toLowerCase();document.querySelectorAll("#licenseTable tr").forEach((r,i)=>{if(i===0)return;r.style.display=r.innerText.toLowerCase().includes(f)?'':'none';});}
+      async function createLicense(e){e.preventDefault();const u=document.getElementById("username").value;const d=document.getElementById("days").value;const c=document.getElementById("customKey").value;const p=document.getElementById("pluginName").value;const s=document.getElementById("seats").value;let url=`/generate?user=${u}&days=${d}&plugin=${p}&seats=${s}`;if(c)url+=`&key=${encodeURIComponent(c)}`;const r=await fetch(url,{method:"POST"});const j=await r.json();alert(j.success?"✅ Created: "+j.key:"❌ "+j.error);location.reload();}
     </script>
     </head><body>
       <h1>🔐 License Manager Dashboard</h1>
@@ -249,28 +2689,33 @@ def admin_dashboard():
         <input id="username" placeholder="User" required>
         <input id="pluginName" placeholder="Plugin name" required>
         <input id="days" type="number" value="30" required>
+        <input id="seats" type="number" value="1" min="1" title="Seats">
         <input id="customKey" placeholder="(Optional custom key)">
         <button class="extend" type="submit">➕ Create</button>
         <button type="button" class="download" onclick="window.location='/backup'">💾 Backup</button>
       </form>
-      <input id="searchBox" onkeyup="search()" placeholder="🔍 Search...">
+      <form method="get" action="/admin"><input id="searchBox" name="q" value="{{q}}" placeholder="🔍 Search..."></form>
+      <p>{{total}} license(s){% if pages>1 %} · page {{page}}/{{pages}}
+        {% if page>1 %}<a href="/admin?q={{q|urlencode}}&page={{page-1}}">◀ Prev</a>{% endif %}
+        {% if page<pages %}<a href="/admin?q={{q|urlencode}}&page={{page+1}}">Next ▶</a>{% endif %}{% endif %}
+        {% if archive_on %} · <a href="/archive?q={{q|urlencode}}">🧊 Search archive</a>{% endif %}</p>
       <table id="licenseTable"><tr><th>Key</th><th>User</th><th>Plugin</th><th>Expires</th><th>Bound</th><th>Status</th><th>Last Check</th><th>Actions</th></tr>
-      {% for k,v in licenses.items() %}
+      {% for k,v in rows %}
         {% set exp=v['expires'] %}
         {% set bound=v.get('bound_to','-') %}
+        {% if v.get('seats',1)>1 %}{% set bound=(v.get('leases',{})|length)~'/'~v['seats']~' seats' %}{% endif %}
         {% set last=v.get('last_check') if v.get('last_check') else '-' %}
         {% set cls='active' %}
-        {% set days_left=(datetime.strptime(exp,'%Y-%m-%d')-datetime.now()).days %}
-        {% if days_left<0 %}{% set cls='expired' %}
-        {% elif days_left<=7 %}{% set cls='warning' %}
-        {% elif not bound or bound=='-' %}{% set cls='unbound' %}{% endif %}
+        {% if exp<tomorrow %}{% set cls='expired' %}
+        {% elif exp<warn_stop %}{% set cls='warning' %}
+        {% elif not bound or bound=='-' or (v.get('seats',1)>1 and not v.get('leases')) %}{% set cls='unbound' %}{% endif %}
         {% set hb='⚫ Inactive' %}
         {% if last!='-' %}
-          {% set diff=(datetime.now()-datetime.strptime(last,'%Y-%m-%d %H:%M:%S')).total_seconds() %}
+          {% set diff=(now-datetime.strptime(last,'%Y-%m-%d %H:%M:%S')).total_seconds() %}
           {% if diff<=5 %}{% set hb='🟢 Active' %}
           {% elif diff<=10 %}{% set hb='🟡 Slow' %}{% endif %}
         {% endif %}
-        <tr class="{{cls}}"><td>{{k}}</td><td>{{v['user']}}</td><td>{{v['plugin']}}</td><td>{{v['expires']}}</td>
+        <tr class="{{cls}}"><td>{{k}}</td><td>{{v['user']}}</td><td>{{plugin_label(v)}}</td><td>{{v['expires']}}</td>
         <td>{{bound}}</td><td>{{hb}}</td><td>{{last}}</td>
         <td><button class="extend" onclick="extendLicense('{{k}}')">Extend</button>
         <button class="expire" onclick="action('expire','{{k}}')">Expire</button>
@@ -278,7 +2723,27 @@ def admin_dashboard():
         <button class="delete" onclick="action('delete','{{k}}')">Delete</button></td></tr>
       {% endfor %}
       </table></body></html>"""
-    return render_template_string(html, licenses=licenses, datetime=datetime)
+    # Only the requested page is rendered; filtering happens in the search index
+    q = request.args.get("q", "").strip()
+    try: page = max(int(request.args.get("page", 1)), 1)
+    except: page = 1
+    start = (page - 1) * ADMIN_PAGE_SIZE
+    if q:
+        keys = search_licenses(q)
+        total = len(keys)
+        rows = [(k, licenses[k]) for k in keys[start:start + ADMIN_PAGE_SIZE] if k in licenses]
+    else:
+        total = len(licenses)
+        rows = [(k, licenses[k]) for k in itertools.islice(licenses, start, start + ADMIN_PAGE_SIZE)]
+    pages = max((total + ADMIN_PAGE_SIZE - 1) // ADMIN_PAGE_SIZE, 1)
+
+    # Warning tiers are the same date bounds the expiry index is queried with (no per-row date math)
+    now = clock.now()
+    tomorrow = day_str(now + timedelta(days=1))
+    warn_stop = day_str(now + timedelta(days=EXPIRY_WARNING_DAYS + 2))
+    return tagged(render_template_string(html, rows=rows, datetime=datetime, now=now, q=q, page=page, pages=pages,
+                                         total=total, tomorrow=tomorrow, warn_stop=warn_stop, plugin_label=plugin_label,
+                                         archive_on=archive is not None), tag)
 
 # ==========================
 # 💻 LOGIN PAGE
@@ -306,16 +2771,17 @@ LOGIN_HTML = """
 """
 
 # ==========================
-# 🛠 KEEP-ALIVE THREAD
+# 🛠 KEEP-ALIVE
 # ==========================
 def keep_alive():
-    while True:
-        try:
-            requests.get("https://plugin-license-server1.onrender.com")
-            print("[KEEPALIVE] Pinged self to stay awake.")
-        except Exception as e:
-            print("[KEEPALIVE] Failed:", e)
-        time.sleep(KEEPALIVE_INTERVAL)
+    try:
+        http.get(KEEPALIVE_URL, timeout=HTTP_TIMEOUT)
+        print("[KEEPALIVE] Pinged self to stay awake.")
+    except Exception as e:
+        print("[KEEPALIVE] Failed:", e)
+
+if KEEPALIVE_URL:
+    scheduler.every("keepalive", KEEPALIVE_INTERVAL, keep_alive, timeout=HTTP_TIMEOUT * 2, delay=0)
 
 
 
@@ -324,20 +2790,102 @@ def keep_alive():
 # ==========================
 # 🌍 ROOT / HEALTH ENDPOINT
 # ==========================
+@app.route("/timing", methods=["GET", "POST"])
+def request_timing():
+    global REQUEST_TIMING
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    if request.method == "POST":
+        REQUEST_TIMING = request.args.get("enabled", "1") == "1"
+    return jsonify({"enabled": REQUEST_TIMING, "slow_ms": SLOW_REQUEST_MS, "slow_requests": list(slow_requests)})
+
+@app.route("/capture", methods=["GET", "POST"])
+def capture_status():
+    global CAPTURE
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    if request.method == "POST":
+        enabled = request.args.get("enabled", "1") == "1"
+        if enabled and not CAPTURE:
+            start_capture()
+        CAPTURE = enabled
+    return jsonify({"enabled": CAPTURE, "file": CAPTURE_FILE, "records": capture["records"],
+                    "dropped": capture["dropped"], "bytes": capture["bytes"], "pending": len(capture_buffer)})
+
+@app.route("/profile/start", methods=["POST"])
+def profile_start():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    try: seconds = min(max(float(request.args.get("seconds", 10)), 0.1), PROFILE_MAX_SECONDS)
+    except: return jsonify({"error": "Invalid seconds"}), 400
+    if profiler["thread"] and profiler["thread"].is_alive():
+        return jsonify({"error": "Profiler already running"}), 409
+    stop, stacks = threading.Event(), {}
+    profiler.update(stop=stop, stacks=stacks, samples=0, seconds=seconds,
+                    started=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    profiler["thread"] = threading.Thread(target=profile_sampler, args=(seconds, stop, stacks), daemon=True, name="profiler")
+    profiler["thread"].start()
+    return jsonify({"success": True, "seconds": seconds, "interval": PROFILE_INTERVAL})
+
+@app.route("/profile/stop", methods=["POST"])
+def profile_stop():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    profiler["stop"].set()
+    if profiler["thread"]:
+        profiler["thread"].join()
+    return profile_report(), 200, {"Content-Type": "text/plain"}
+
+@app.route("/profile")
+def profile_result():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    running = bool(profiler["thread"] and profiler["thread"].is_alive())
+    return profile_report(), 200, {
+        "Content-Type": "text/plain",
+        "X-Profile-Running": str(running).lower(),
+        "X-Profile-Samples": str(profiler["samples"])
+    }
+
+@app.route("/audit")
+def audit_log():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    key, user_id, event = request.args.get("key"), request.args.get("user_id"), request.args.get("event")
+    try: limit = min(max(int(request.args.get("limit", 100)), 1), AUDIT_RECENT)
+    except: return jsonify({"error": "Invalid limit"}), 400
+    matches = []
+    for record in reversed(audit_recent):  # newest first
+        if (key and record["key"] != key) or (user_id and record.get("user_id") != user_id) \
+                or (event and record["event"] != event):
+            continue
+        matches.append(record)
+        if len(matches) >= limit:
+            break
+    return jsonify({"events": matches, "dropped": audit_ring.dropped, "pending": audit_ring.head - audit_ring.read})
+
+@app.route("/scheduler")
+def scheduler_status():
+    if not require_login(): return jsonify({"error": "Unauthorized"}), 403
+    return jsonify({name: task.stats() for name, task in list(scheduler.tasks.items())})
+
+@app.route("/metrics")
+def metrics():
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
 @app.route("/")
 def home():
     return jsonify({
         "status": "online",
         "message": "Plugin License Server is running ✅!! Rex is God! Created By Rex!!",
-        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        "time": clock.now().strftime("%Y-%m-%d %H:%M:%S")
     }), 200
 
 
 # ==========================
 # 🚀 RUN SERVER
 # ==========================
+# Background tasks run however the app is served (python main.py, gunicorn, ...), not only under __main__
+if SCHEDULER_AUTOSTART:
+    atexit.register(scheduler.stop)
+    scheduler.start()
+
 if __name__ == "__main__":
-    threading.Thread(target=keep_alive, daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # run atexit hooks on SIGTERM too
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
 
 
@@ -0,0 +1,299 @@
+# ==========================
+# 🎬 CAPTURE REPLAY
+# ==========================
+# Replays a traffic capture (CAPTURE=1 / POST /capture, see main.py) against a scratch server and
+# compares the result with what production saw. The store is seeded from the capture itself:
+# every key id that was ever answered by the store becomes a license with the plugin, expiry,
+# seat count and holder implied by its first recorded outcome, so activations, refreshes,
+# license_in_use, wrong_plugin, expired and invalid-key traffic come out in their real mix.
+#
+#   python replay_capture.py capture.jsonl --speed 1           # real time
+#   python replay_capture.py capture.jsonl --speed 20 --env LICENSE_STORAGE=catalog --out run.json
+#   python replay_capture.py capture.jsonl --speed 0           # as fast as the server allows, in order
+#
+# Captured latencies are server-side (after_request), replayed ones are client-side round trips.
+import argparse, base64, json, os, sys, tempfile, threading, time, requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from bench_heartbeat import start_server, scrape, percentile
+
+ADMIN_PATHS = {"generate_license": "/generate", "extend_license": "/extend", "expire_license": "/expire",
+               "unbind_license": "/unbind", "set_seats": "/seats", "delete_license": "/delete", "backup": "/backup",
+               "changes": "/changes", "search": "/search", "stats": "/stats", "expiring_licenses": "/expiring",
+               "admin_dashboard": "/admin", "archive_search": "/archive", "archive_restore": "/archive/restore",
+               "list_plugins": "/plugins", "update_plugin": "/plugins"}
+NUMERIC_ARGS = {"days", "seats", "page", "since"}  # captured as integers; every other argument is a hashed id
+ADMIN_WRITES = {"generate_license", "extend_license", "expire_license", "unbind_license", "set_seats", "delete_license",
+                "archive_restore", "update_plugin"}  # replayed in capture order, after everything before them
+STORE_OUTCOMES = {"activated", "refreshed", "license_in_use", "expired", "rate_limited"}  # key + plugin matched
+
+def hexid(capture_id):
+    return base64.urlsafe_b64decode(capture_id).hex() if capture_id else ""
+
+# -> [(ms since the first record, record)], ordered; sessions are placed by their header's wall time
+def load(path):
+    events, base = [], 0
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict):
+                base = record["started"] * 1000
+                continue
+            events.append((base + record[0], record))
+    events.sort(key=lambda e: e[0])
+    start = events[0][0] if events else 0
+    return [(at - start, record) for at, record in events]
+
+def seed_store(events, path):
+    generated = {r[8] for _, r in events if r[1] == "a" and r[3] == "generate_license" and r[8]}
+    first, plugin, seats = {}, {}, {}
+    for _, r in events:
+        if r[1] not in ("v", "b") or not r[2] or r[2] in generated:
+            continue
+        first.setdefault(r[2], r)
+        if r[6] in STORE_OUTCOMES and r[4]:
+            plugin.setdefault(r[2], r[4])
+        if r[8]:
+            seats[r[2]] = max(seats.get(r[2], 1), r[8])
+    now = datetime.now()
+    stamp = now.strftime("%Y-%m-%d %H:%M:%S")
+    keys, data = {}, {}
+    for key_id, r in first.items():
+        if key_id not in plugin and r[6] != "wrong_plugin":
+            continue  # never matched a stored license (invalid_key / missing plugin name)
+        key = keys[key_id] = f"REPLAY{hexid(key_id).upper()}"
+        expired = r[6] == "expired"
+        info = {"user": f"u{hexid(key_id)[:8]}", "plugin": "p" + hexid(plugin.get(key_id) or key_id),
+                "expires": (now + timedelta(days=-1 if expired else 365)).strftime("%Y-%m-%d"),
+                "in_use": False, "bound_to": None, "last_check": None}
+        holder = hexid(r[3]) if r[6] == "refreshed" else "captured-holder" if r[6] == "license_in_use" else None
+        if seats.get(key_id, 1) > 1:
+            info["seats"] = seats[key_id]
+            holders = [holder] if r[6] == "refreshed" else \
+                [f"captured-holder-{i}" for i in range(info["seats"])] if holder else []
+            info["leases"] = {h: [i, stamp] for i, h in enumerate(holders)}
+        elif holder:
+            info.update(in_use=True, bound_to=holder, last_check=stamp)
+        data[key] = info
+    with open(path, "w") as f:
+        json.dump(data, f)
+    for key_id in generated:
+        keys[key_id] = f"REPLAY{hexid(key_id).upper()}"  # /generate is replayed with this custom key
+    return keys, len(data)
+
+# Same labels as the server's verify outcomes
+def verify_outcome(body, status):
+    if status == 503:
+        return "shed"
+    if body.get("valid"):
+        return "activated" if body.get("note") == "License activated" else "refreshed"
+    reason = body.get("reason") or str(status)
+    return "license_in_use" if reason == "seats_full" else reason
+
+OUTCOME_GROUPS = {"verify": {"verify", "batch"}, "heartbeat": {"heartbeat"}, "admin": {"admin"}}
+HEARTBEAT_OUTCOMES = {204: "lease_ok", 410: "lease_gone", 404: "lease_unknown", 421: "lease_wrong_shard", 503: "shed"}
+
+class Replay:
+    def __init__(self, base, keys, seeded, workers):
+        self.base, self.keys, self.seeded = base, keys, seeded
+        self.local = threading.local()
+        self.leases = {}  # (key id, seat) -> lease handle from the latest verify
+        self.lock = threading.Lock()
+        self.results = []  # (kind, captured outcome, replayed outcome, captured latency s, replayed latency s)
+        self.skipped = {}
+        self.pool = ThreadPoolExecutor(workers)
+        self.admin = requests.Session()
+        self.admin.post(base + "/login", data={"username": "Admin@admin", "password": "@adminsecret"})
+
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def key(self, key_id):
+        return self.keys.get(key_id) or f"UNKNOWN{hexid(key_id).upper()}"
+
+    def check(self, r):
+        return {"key": self.key(r[2]), "user_id": hexid(r[3]), "plugin": "p" + hexid(r[4]) if r[4] else ""}
+
+    def remember_lease(self, key_id, body):
+        lease = body.get("lease")
+        if lease:
+            with self.lock:
+                self.leases[(key_id, body.get("seat", 0))] = lease
+
+    def record(self, kind, captured, replayed, captured_us, elapsed):
+        with self.lock:
+            self.results.append((kind, captured, replayed, captured_us / 1e6, elapsed))
+
+    def skip(self, why):
+        with self.lock:
+            self.skipped[why] = self.skipped.get(why, 0) + 1
+
+    def timed(self, method, url, session=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            r = (session or self.session()).request(method, url, timeout=30, **kwargs)
+        except requests.RequestException as e:
+            return None, type(e).__name__, time.perf_counter() - started
+        return r, None, time.perf_counter() - started
+
+    def verify(self, r):
+        resp, error, elapsed = self.timed("GET", self.base + "/verify", params=self.check(r))
+        body = resp.json() if resp is not None and resp.headers.get("Content-Type", "").startswith("application/json") else {}
+        self.remember_lease(r[2], body)
+        self.record("verify", r[6], error or verify_outcome(body, resp.status_code), r[7], elapsed)
+
+    def batch(self, records):
+        resp, error, elapsed = self.timed("POST", self.base + "/verify/batch",
+                                          json={"checks": [self.check(r) for r in records]})
+        answers = resp.json().get("results") if resp is not None and resp.status_code == 200 else None
+        for i, r in enumerate(records):
+            body = answers[i] if answers else {}
+            if answers:
+                self.remember_lease(r[2], body)
+            replayed = error or (verify_outcome(body, body.get("status", 200)) if answers else verify_outcome({}, resp.status_code))
+            self.record("batch", r[6], replayed, r[7], elapsed)
+
+    # issuer = future of the latest verify / batch of the same key; it was queued first (FIFO pool),
+    # so waiting for it can't starve the pool
+    def heartbeat(self, r, issuer=None):
+        if issuer is not None:
+            issuer.result()
+        with self.lock:
+            lease = self.leases.get((r[2], r[3] or 0))
+        if lease is None:
+            return self.skip("heartbeat_without_lease")
+        resp, error, elapsed = self.timed("POST", f"{self.base}/hb/{lease}")
+        self.record("heartbeat", r[5], error or HEARTBEAT_OUTCOMES.get(resp.status_code, str(resp.status_code)), r[6], elapsed)
+
+    def admin_call(self, r):
+        method, endpoint, key_id, args, status, latency, new_key = r[2:9]
+        params = {}
+        for name, value in (args or {}).items():
+            if name == "q":
+                continue  # hashed query text has nothing to match
+            params[name] = value if name in NUMERIC_ARGS else \
+                ("p" if name == "plugin" else "u" if name == "user" else "") + hexid(value)
+        if key_id or new_key:
+            params["key"] = self.key(key_id or new_key)
+        resp, error, elapsed = self.timed(method, self.base + ADMIN_PATHS[endpoint], session=self.admin, params=params)
+        self.record("admin", f"{endpoint} {status}", error or f"{endpoint} {resp.status_code}", latency, elapsed)
+
+    def run(self, events, speed):
+        started = time.perf_counter()
+        lag, futures, i = 0.0, [], 0
+        issuers = {}  # key id -> future of its latest verify / batch (hands out the lease handle)
+        while i < len(events):
+            at, r = events[i]
+            if speed:
+                delay = started + at / 1000 / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    lag = max(lag, -delay)
+            if r[1] == "b":
+                group = [r]  # checks of one batch request share their timestamp
+                while i + 1 < len(events) and events[i + 1][1][1] == "b" and events[i + 1][0] == at:
+                    i += 1
+                    group.append(events[i][1])
+                futures.append(self.pool.submit(self.batch, group))
+                issuers.update((check[2], futures[-1]) for check in group)
+            elif r[1] == "v":
+                futures.append(self.pool.submit(self.verify, r))
+                issuers[r[2]] = futures[-1]
+            elif r[1] == "h":
+                futures.append(self.pool.submit(self.heartbeat, r, issuers.get(r[2])))
+            elif r[1] == "a" and r[3] in ADMIN_WRITES:
+                for f in futures:
+                    f.result()
+                futures, issuers = [], {}
+                self.admin_call(r)
+            elif r[1] == "a" and r[3] in ADMIN_PATHS:
+                futures.append(self.pool.submit(self.admin_call, r))
+            else:
+                self.skip("unknown_record")
+            i += 1
+        for f in futures:
+            f.result()
+        self.pool.shutdown()
+        return time.perf_counter() - started, lag
+
+def latency_ms(values):
+    values = sorted(values)
+    summary = {p: round((percentile(values, int(p[1:])) or 0) * 1000, 3) for p in ("p50", "p90", "p99")}
+    summary["max"] = round(values[-1] * 1000, 3) if values else 0
+    return summary
+
+def outcome_diff(results):
+    captured, replayed = {}, {}
+    for _, c, r, _, _ in results:
+        captured[c] = captured.get(c, 0) + 1
+        replayed[r] = replayed.get(r, 0) + 1
+    total = len(results) or 1
+    return {name: {"captured": captured.get(name, 0), "replayed": replayed.get(name, 0),
+                   "diff_pct": round((replayed.get(name, 0) - captured.get(name, 0)) * 100 / total, 2)}
+            for name in sorted(captured.keys() | replayed.keys())}
+
+def report(args, events, replay, elapsed, lag, before, after):
+    results = replay.results
+    captured_span = events[-1][0] / 1000 if events else 0
+    kinds = sorted({r[0] for r in results})
+    written = after.get("license_persist_bytes_total", 0) - before.get("license_persist_bytes_total", 0)
+    return {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {"capture": args.capture, "speed": args.speed, "workers": args.workers, "env": args.env,
+                   "server_cmd": args.server_cmd},
+        "capture": {"records": len(events), "span_s": round(captured_span, 3), "seeded_licenses": replay.seeded,
+                    "rate_rps": round(len(events) / captured_span, 2) if captured_span else None},
+        "replay": {"requests": len(results), "elapsed_s": round(elapsed, 3),
+                   "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0,
+                   "max_schedule_lag_s": round(lag, 3), "skipped": replay.skipped,
+                   "persist_writes": after.get("license_persist_writes_total", 0) - before.get("license_persist_writes_total", 0),
+                   "bytes_written": written},
+        "latency_ms": {kind: {"captured": latency_ms([r[3] for r in results if r[0] == kind]),
+                              "replayed": latency_ms([r[4] for r in results if r[0] == kind])} for kind in kinds},
+        "outcomes": {name: outcome_diff([r for r in results if r[0] in members])
+                     for name, members in OUTCOME_GROUPS.items() if members & set(kinds)},
+        "agreement": round(sum(1 for r in results if r[1] == r[2]) / len(results), 4) if results else None,
+    }
+
+def run(args):
+    events = load(args.capture)
+    if not events:
+        raise SystemExit("capture is empty")
+    with tempfile.TemporaryDirectory(prefix="replay_capture_") as workdir:
+        return replay_into(args, events, workdir)
+
+def replay_into(args, events, workdir):
+    keys, seeded = seed_store(events, os.path.join(workdir, "licenses.json"))
+    env = dict(kv.split("=", 1) for kv in args.env)
+    env.setdefault("ARCHIVE_AFTER_DAYS", "0")  # the replay must not archive the freshly seeded store
+    proc, base = start_server(workdir, args.port, env, args.server_cmd.split() if args.server_cmd else None)
+    try:
+        replay = Replay(base, keys, seeded, args.workers)
+        before = scrape(base)
+        elapsed, lag = replay.run(events, args.speed)
+        after = scrape(base)
+    finally:
+        proc.terminate()
+        proc.wait(10)
+    return report(args, events, replay, elapsed, lag, before, after)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a verify / admin traffic capture against a scratch server")
+    parser.add_argument("capture", help="CAPTURE_FILE written by the server")
+    parser.add_argument("--speed", type=float, default=1, help="time acceleration (1 = real time, 0 = no pacing)")
+    parser.add_argument("--workers", type=int, default=32, help="concurrent replay connections")
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE passed to the server")
+    parser.add_argument("--server-cmd", help="override the server command (run in the seeded directory)")
+    parser.add_argument("--out", help="write the JSON report here as well as stdout")
+    args = parser.parse_args()
+    result = json.dumps(run(args), indent=2)
+    print(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(result)
@@ -0,0 +1,237 @@
+# ==========================
+# 🧪 ACCELERATED LEASE SIMULATION
+# ==========================
+# Drives the server's real verify / lease / expiry code with a VirtualClock: synthetic plugin hosts
+# start sessions, heartbeat, miss beats and quit without releasing, while licenses expire and get
+# renewed - days of traffic in minutes. Prints a JSON report of lease churn, in-use peaks and
+# persistence volume, to size HEARTBEAT_TIMEOUT and storage before changing production settings:
+#
+#   python simulate_leases.py --licenses 2000 --hosts 2600 --days 7 --timeout 600 --out sim.json
+#
+# By default writes are accounted, not performed: each one is charged the store's serialized size
+# (re-measured every virtual hour). --persist real writes the files (small runs only).
+import argparse, contextlib, heapq, json, os, random, shutil, sys, tempfile, time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PLUGIN = "SimPlugin"
+
+def load_server(workdir, storage):
+    os.chdir(workdir)
+    os.environ.update(LICENSE_STORAGE=storage, KEEPALIVE_URL="", SCHEDULER_AUTOSTART="0")
+    sys.path.insert(0, HERE)
+    import main
+    return main
+
+def seed(main, args, rng, start):
+    keys = []
+    for i in range(args.licenses):
+        key = main.generate_key(PLUGIN)
+        expires = start + timedelta(days=rng.uniform(1, args.expiry_days))
+        main.licenses[key] = main.normalize_record({"user": f"customer{i}", "plugin": PLUGIN,
+                                                    "expires": expires.strftime("%Y-%m-%d"), "in_use": False,
+                                                    "bound_to": None, "last_check": None})
+        keys.append(key)
+    main.build_indexes()
+    main.build_key_filter()
+    return keys
+
+# ==========================
+# 🔁 EVENT LOOP
+# ==========================
+def run(args):
+    cwd, workdir = os.getcwd(), tempfile.mkdtemp(prefix="license-sim-")
+    try:
+        return simulate(args, workdir)
+    finally:
+        os.chdir(cwd)  # load_server moved into the scratch dir; --out stays relative to the caller
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def simulate(args, workdir):
+    rng = random.Random(args.seed)
+    main = load_server(workdir, args.storage)
+    if args.timeout:
+        main.HEARTBEAT_TIMEOUT = args.timeout
+    start = datetime(2030, 1, 1)
+    main.clock = main.VirtualClock(start)
+    keys = seed(main, args, rng, start)
+
+    audits = {}
+    def count_audit(event, key, user_id=None, **extra):
+        audits[event] = audits.get(event, 0) + 1
+    main.audit = count_audit  # churn comes from the server's own state transitions
+
+    persist = {"writes": 0, "bytes": 0, "store_bytes": 0}
+    real_save = main.save_licenses
+    def measure_store():
+        persist["store_bytes"] = len(json.dumps(dict(main.licenses.items()), indent=2))
+    def account_write():
+        persist["writes"] += 1
+        persist["bytes"] += persist["store_bytes"]
+    if args.persist == "estimate":
+        main.save_licenses = account_write
+    measure_store()
+
+    end = args.days * 86400
+    events, seq = [], 0
+    def at(t, kind, who):
+        nonlocal seq
+        seq += 1
+        heapq.heappush(events, (t, seq, kind, who))
+
+    hosts = args.hosts
+    key_of = [keys[i % len(keys)] for i in range(hosts)]
+    session_end = [0.0] * hosts
+    holding = [False] * hosts
+    handle = [None] * hosts
+    for i in range(hosts):
+        at(rng.expovariate(1 / args.idle_mean), "start", i)
+    for key in keys:
+        at((datetime.strptime(main.licenses[key]["expires"], "%Y-%m-%d") - start).total_seconds() + 86400, "renew", key)
+    for hour in range(int(end // 3600) + 1):
+        at(hour * 3600.0, "tick", hour)
+
+    outcomes, churn = {}, {"evicted_while_alive": 0, "denied": 0, "renewed": 0, "sessions": 0}
+    peak = {"in_use": 0, "at": 0.0, "live": 0}
+    live = 0
+    timeline, hour_stats = [], None
+    verifies = 0
+    started = time.perf_counter()
+
+    def verify(i):
+        nonlocal verifies
+        verifies += 1
+        if args.lease and holding[i] and handle[i]:
+            result = main.refresh_lease(handle[i])
+            if result == "ok":
+                return "refreshed"
+        outcome, body, _ = main.check_license(key_of[i], f"host-{i}", PLUGIN)
+        if body and body.get("lease"):
+            handle[i] = body["lease"]
+        return outcome
+
+    def beat_later(i, t):
+        at(t + args.interval * rng.uniform(0.9, 1.1), "beat", i)
+
+    def attempt(i, t):
+        nonlocal live
+        outcome = verify(i)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        if outcome in ("activated", "refreshed"):
+            if not holding[i]:
+                holding[i] = True
+                live += 1
+            beat_later(i, t)
+            return
+        if holding[i]:
+            holding[i] = False
+            live -= 1
+            if outcome == "license_in_use":
+                churn["evicted_while_alive"] += 1  # reclaimed while the host was still running
+        if outcome == "license_in_use":
+            churn["denied"] += 1
+            if t + args.retry < session_end[i]:
+                at(t + args.retry, "retry", i)
+                return
+        at(t + rng.expovariate(1 / args.idle_mean), "start", i)
+
+    while events:
+        t, _, kind, who = heapq.heappop(events)
+        if t > end:
+            break
+        main.clock.current = start + timedelta(seconds=t)
+        if kind == "tick":
+            main.process_expiries()
+            measure_store()
+            if hour_stats:
+                timeline.append(hour_stats)
+            hour_stats = {"hour": who, "in_use_peak": 0, "live_peak": 0, "verifies": verifies,
+                          "writes": persist["writes"] if args.persist == "estimate" else main.persist_stats["writes"]}
+        elif kind == "renew":
+            info = main.licenses.get(who)
+            if info is not None and rng.random() < args.renew:
+                info["expires"] = (main.clock.now() + timedelta(days=30)).strftime("%Y-%m-%d")
+                info.pop("expired", None)
+                main.save_licenses(); main.license_changed(who)
+                churn["renewed"] += 1
+                at(t + 30 * 86400, "renew", who)
+        elif kind == "start":
+            session_end[who] = t + rng.expovariate(1 / args.session_mean)
+            churn["sessions"] += 1
+            attempt(who, t)
+        elif kind == "retry":
+            attempt(who, t)
+        elif kind == "beat":
+            if not holding[who]:
+                continue
+            if t >= session_end[who]:
+                holding[who] = False  # quits without releasing; the lease has to time out
+                live -= 1
+                at(t + rng.expovariate(1 / args.idle_mean), "start", who)
+            elif rng.random() < args.miss:
+                beat_later(who, t)  # heartbeat lost on the way
+            else:
+                attempt(who, t)
+        in_use = len(main.bound_keys)
+        if in_use > peak["in_use"]:
+            peak.update(in_use=in_use, at=t)
+        peak["live"] = max(peak["live"], live)
+        if hour_stats:
+            hour_stats["in_use_peak"] = max(hour_stats["in_use_peak"], in_use)
+            hour_stats["live_peak"] = max(hour_stats["live_peak"], live)
+
+    wall = time.perf_counter() - started
+    if args.persist == "real":
+        writes, written = main.persist_stats["writes"], main.persist_stats["bytes"]
+    else:
+        writes, written = persist["writes"], persist["bytes"]
+    for row, nxt in zip(timeline, timeline[1:] + [None]):
+        row["verifies"] = (nxt["verifies"] if nxt else verifies) - row["verifies"]
+        row["writes"] = (nxt["writes"] if nxt else writes) - row["writes"]
+    main.save_licenses = real_save
+    return {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "heartbeat_timeout": main.HEARTBEAT_TIMEOUT,
+        "virtual_seconds": end,
+        "wall_seconds": round(wall, 2),
+        "speedup": round(end / wall) if wall else None,
+        "verifies": verifies,
+        "verifies_per_wall_second": round(verifies / wall) if wall else None,
+        "outcomes": outcomes,
+        "churn": dict(churn, activations=audits.get("claimed", 0), lost_to_timeout=audits.get("lost", 0),
+                      expired_while_bound=audits.get("expired", 0)),
+        "in_use": {"peak": peak["in_use"], "peak_at_hour": round(peak["at"] / 3600, 2), "live_sessions_peak": peak["live"]},
+        "persistence": {"mode": args.persist, "writes": writes, "bytes": written,
+                        "bytes_per_virtual_day": round(written / args.days),
+                        "writes_suppressed": main.verify_stats["writes_suppressed"],
+                        "store_bytes": persist["store_bytes"]},
+        "timeline": timeline if args.timeline else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accelerated lease simulation against the license server code")
+    parser.add_argument("--licenses", type=int, default=2000)
+    parser.add_argument("--hosts", type=int, default=2600, help="plugin hosts (host i uses license i mod licenses)")
+    parser.add_argument("--days", type=float, default=7, help="virtual days to simulate")
+    parser.add_argument("--interval", type=float, default=300, help="client heartbeat interval (seconds)")
+    parser.add_argument("--timeout", type=int, help="override HEARTBEAT_TIMEOUT (seconds)")
+    parser.add_argument("--session-mean", type=float, default=4 * 3600, help="mean session length (seconds)")
+    parser.add_argument("--idle-mean", type=float, default=2 * 3600, help="mean gap between sessions (seconds)")
+    parser.add_argument("--retry", type=float, default=300, help="seconds before a denied host retries")
+    parser.add_argument("--miss", type=float, default=0.02, help="probability a heartbeat never arrives")
+    parser.add_argument("--expiry-days", type=float, default=60, help="licenses expire uniformly within this many days")
+    parser.add_argument("--renew", type=float, default=0.7, help="probability an expired license is renewed (30 days)")
+    parser.add_argument("--lease", action="store_true", help="heartbeat with lease handles (/hb) instead of full verifies")
+    parser.add_argument("--storage", choices=("json", "catalog"), default="json")
+    parser.add_argument("--persist", choices=("estimate", "real"), default="estimate")
+    parser.add_argument("--timeline", action="store_true", help="include per-virtual-hour rows")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the JSON report here as well as stdout")
+    args = parser.parse_args()
+    with contextlib.redirect_stdout(sys.stderr):  # server log lines stay out of the report
+        report = json.dumps(run(args), indent=2)
+    print(report)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report)